@@ -18,6 +18,13 @@ function epochToDateTime(epochTime){
   return dateTime;
 }
 
+// convert forecast seconds to "3 h 12 min"
+function secondsToDuration(seconds){
+  var hours = Math.floor(seconds / 3600);
+  var minutes = Math.floor((seconds % 3600) / 60);
+  return (hours > 0 ? hours + " h " : "") + minutes + " min";
+}
+
 // function to plot values on charts
 function plotValues(chart, timestamp, value){
   var x = epochToJsDate(timestamp).getTime();
@@ -54,12 +61,18 @@ const tempElement = document.getElementById("temp");
 const humElement = document.getElementById("hum");
 const voltElement = document.getElementById("volt");
 const updateElement = document.getElementById("lastUpdate")
+const forecastElement = document.getElementById("forecast");
 
 // Elements for GPIO states
 const stateElement1 = document.getElementById("state1");
 const stateElement2 = document.getElementById("state2");
 const stateElement3 = document.getElementById("state3");
 
+// Elements for high-resolution capture
+const captureDurationElement = document.getElementById("capture-duration");
+const captureStateElement = document.getElementById("capture-state");
+const btnCapture = document.getElementById('btnCapture');
+
 // Button Elements
 const btn1On = document.getElementById('btn1On');
 const btn1Off = document.getElementById('btn1Off');
@@ -73,7 +86,13 @@ var dbPathOutput1 = 'board1/outputs/digital/13';
 var dbPathOutput2 = 'board1/outputs/digital/6';
 var dbPathOutput3 = 'board1/outputs/digital/5';
 
+// Database paths for high-resolution capture (request is cleared by the Pi once accepted)
+var dbPathCaptureRequest = 'board1/capture/request';
+var dbPathCaptureStatus = 'board1/capture/status';
+
 // Database references
+var dbRefCaptureRequest = firebase.database().ref().child(dbPathCaptureRequest);
+var dbRefCaptureStatus = firebase.database().ref().child(dbPathCaptureStatus);
 var dbRefOutput1 = firebase.database().ref().child(dbPathOutput1);
 var dbRefOutput2 = firebase.database().ref().child(dbPathOutput2);
 var dbRefOutput3 = firebase.database().ref().child(dbPathOutput3);
@@ -136,6 +155,23 @@ const setupUI = (user) => {
         dbRefOutput3.set(1);
     }
 
+    // High-resolution capture: show progress and send requests
+    dbRefCaptureStatus.on('value', snap => {
+        var status = snap.val();
+        if (status == null) {
+            captureStateElement.innerText = "IDLE";
+        }
+        else if (status.state == "done") {
+            captureStateElement.innerText = "DONE (" + status.samples + " samples)";
+        }
+        else {
+            captureStateElement.innerText = status.state.toUpperCase();
+        }
+    });
+    btnCapture.onclick = () =>{
+        dbRefCaptureRequest.set({duration: Number(captureDurationElement.value)});
+    }
+
 
     // get user UID to get data from database
     var uid = user.uid;
@@ -227,6 +263,16 @@ const setupUI = (user) => {
       humElement.innerHTML = humidity;
       voltElement.innerHTML = voltage;
       updateElement.innerHTML = epochToDateTime(timestamp);
+      // Forecast from the voltage trend (only present when the trend is clear)
+      if (jsonData.tte_s !== undefined){
+        forecastElement.innerHTML = "Low in " + secondsToDuration(jsonData.tte_s);
+      }
+      else if (jsonData.ttf_s !== undefined){
+        forecastElement.innerHTML = "Full in " + secondsToDuration(jsonData.ttf_s);
+      }
+      else{
+        forecastElement.innerHTML = "--";
+      }
     });
 
     // GAUGES
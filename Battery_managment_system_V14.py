@@ -2,6 +2,7 @@
 import board  # For board pin definitions (SCL, SDA)
 import busio  # For I2C communication
 #import requests  # Not used, kept for future HTTP requests
+import os  # To locate the config file next to this script
 import logging  # For logging system status and events
 import threading  # For running Firebase listener in a separate thread
 import firebase_admin  # Firebase Admin SDK to access database and authentication
@@ -9,12 +10,44 @@ import firebase_admin  # Firebase Admin SDK to access database and authenticatio
 # from firebase_admin we import specific modules
 from firebase_admin import credentials, db, auth  # To authenticate and interact with Firebase DB
 from requests.exceptions import ConnectionError  # To catch network-related exceptions
-from time import sleep, time  # sleep() for delays, time() for timestamps
+from time import sleep, monotonic  # sleep() for retry delays, monotonic() for sample times
 from ina226 import INA226, DeviceRangeError  # Library to interact with INA226 current sensor
 from gpiozero import OutputDevice  # To control relays via GPIO pins
 from datetime import datetime  # To get timestamps in human-readable form
 from adafruit_bmp280 import Adafruit_BMP280_I2C  # For BMP280 temperature sensor over I2C
 from adafruit_ahtx0 import AHTx0  # For AHT20 temperature and humidity sensor
+from firebase_client import FirebaseBridge, admin_token_provider  # Pooled async REST client for uploads
+from relay_state import RelayStateMirror  # Local relay cache mirrored to Firebase
+from bms_config import ConfigManager  # Validated, hot-reloadable settings
+from capture import CaptureRecorder  # Dashboard-triggered high-rate INA226 capture
+from backfill import BackfillQueue  # Chunked, compressed re-upload after outages
+from resistance import InternalResistanceEstimator  # dV/dI from current steps
+from charger_policy import charger_decision  # Hysteresis charger control (also used by threshold_sim.py)
+from bms_logging import setup_logging  # Queue-based JSON-lines logging with rotation
+from scheduler import TickScheduler  # Fixed-rate monotonic job scheduler
+from lan_stream import TelemetryHub, LanTelemetryServer  # Live SSE feed for local dashboards
+from anomaly import AnomalyDetector  # Rolling z-score / CUSUM fault detection
+from counters import EnergyCounters  # Persistent energy / relay-wear totals
+from forecast import TrendForecaster, SETTLE_S  # Time-to-empty / time-to-full from the voltage trend
+from trace_replay import TraceRecorder  # Raw trace recording for off-site replay
+from profiling_hooks import StackSampler, install_signal_handler, ControlSocket  # On-demand profiling
+from sinks import FanOut, FirebaseSink, CsvFileSink, LineProtocolSink  # Per-sink queued reading outputs
+
+#%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%% Logging for debugging   %%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%
+
+# Records are queued and written by a background thread as JSON lines (also echoed
+# to the terminal); the file rotates at 1 MB and keeps 5 gzip-compressed generations
+# Sensor read failures repeat every sample, so bms.sensors gets a tighter budget:
+# a burst of 10, then one record per 10 s with a count of the suppressed ones
+log_listener = setup_logging('/home/pi/bms.log', level=logging.INFO, max_bytes=1024 * 1024, backup_count=5,
+                             rate_limits={"bms.sensors": (0.1, 10)})
+log = logging.getLogger("bms.main")
+log_sensors = logging.getLogger("bms.sensors")
+log_anomaly = logging.getLogger("bms.anomaly")  # Own rate budget, not starved by sensor failures
+log_relay = logging.getLogger("bms.relay")
+log_firebase = logging.getLogger("bms.firebase")
+log.info("Battery monitoring started")
+
 
 #%%%%%%%%%%%%%%%%%%%% Wi-Fi, Firebase Setup, and I2C Sensor Initialization   %%%%%%%%%%%%%%%%%%%%%%
 
@@ -38,37 +71,67 @@ firebase_admin.initialize_app(cred, {'databaseURL': DATABASE_URL})  # Initialize
 # Get the UID of the user (used to identify whose data we are uploading to Firebase)
 USER_UID = auth.get_user_by_email(USER_EMAIL).uid
 
-# Define delay for sending data to Firebase
-timer_delay = 18  # seconds
+# Async REST client used for all uploads (runs on its own thread, never blocks main_loop)
+firebase = FirebaseBridge(DATABASE_URL, token_provider=admin_token_provider(cred),
+                          max_connections=4, timeout=10)
+
+# Load tunable settings (thresholds, upload delay, shunt, relay pins, I2C addresses)
+# Edit bms_config.json or board1/config in Firebase; changes apply without a restart
+CONFIG_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "bms_config.json")
+config = ConfigManager(CONFIG_PATH)
+cfg = config.load()  # Raises ValueError on an invalid file
 
 # Initialize I2C bus on Raspberry Pi
 i2c = busio.I2C(board.SCL, board.SDA)  # Create I2C bus using SCL and SDA pins
 
 # Initialize BMP280 temperature sensor
-bmp280 = Adafruit_BMP280_I2C(i2c, address=0x77)
-bmp280.sea_level_pressure = 1013.25  # Set sea-level pressure for altitude compensation
+bmp280 = Adafruit_BMP280_I2C(i2c, address=cfg.bmp280_address)
+bmp280.sea_level_pressure = cfg.sea_level_pressure  # Set sea-level pressure for altitude compensation
 
 # Initialize AHT20 humidity + temperature sensor
 aht20 = AHTx0(i2c)
 
 # Try initializing the INA226 current sensor with proper configuration
-try:
-    ina = INA226(address=0x40, shunt_ohms=0.352)  # Create INA226 object
-    ina.configure(
-        avg_mode=INA226.AVG_4BIT,  # Set averaging mode for noise reduction
-        bus_ct=INA226.VCT_1100us_BIT,  # Set bus voltage conversion time
-        shunt_ct=INA226.VCT_1100us_BIT  # Set shunt voltage conversion time
-    )
-except Exception as e:
-    print("INA226 init/config error:", e)  # Print error if initialization fails
-    ina = None  # Set INA226 object to None to prevent further crashes
-    
-    
+def init_ina226(settings):
+    try:
+        sensor = INA226(address=settings.ina226_address, shunt_ohms=settings.shunt_ohms)  # Create INA226 object
+        sensor.configure(
+            avg_mode=INA226.AVG_4BIT,  # Set averaging mode for noise reduction
+            bus_ct=INA226.VCT_1100us_BIT,  # Set bus voltage conversion time
+            shunt_ct=INA226.VCT_1100us_BIT  # Set shunt voltage conversion time
+        )
+        return sensor
+    except Exception as e:
+        log_sensors.error("INA226 init/config error: %s", e)  # Log error if initialization fails
+        return None  # Set INA226 object to None to prevent further crashes
+
+ina = init_ina226(cfg)
+
+# The INA226 is read from main_loop and from capture runs; one I2C transaction at a time
+ina_lock = threading.Lock()
+
+
+def apply_hot_config(old, new):
+    """
+    Apply settings that touch already-initialised hardware.
+    Thresholds and timer_delay need nothing here: main_loop reads
+    config.current on every pass.
+    """
+    global ina
+    if new.shunt_ohms != old.shunt_ohms:
+        with ina_lock:
+            ina = init_ina226(new)  # Shunt value is fixed at INA226 construction
+    if new.sea_level_pressure != old.sea_level_pressure:
+        bmp280.sea_level_pressure = new.sea_level_pressure
+
+config.on_change.append(apply_hot_config)
+
+
 
 #%%%%%%%%%%%%%%%%%%%%%%%%%%%%%  GPIO (Relays) Setup   %%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%
 
 # GPIO pin numbers connected to relays
-Relay = [5, 6, 13]
+Relay = list(cfg.relay_pins)
 
 # Initialize relays as OutputDevice objects, active-high, initially ON (inactive)
 relays = [OutputDevice(pin, active_high=True, initial_value=True) for pin in Relay]
@@ -76,7 +139,46 @@ relays = [OutputDevice(pin, active_high=True, initial_value=True) for pin in Rel
 # Initialize dictionary to track if manual override has been triggered for each relay
 manual_override = {gpio: False for gpio in Relay}
 
-%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%  Helper Methods   %%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%
+# Local relay-state cache: single source of truth for the outputs, written back
+# to board1/outputs/digital with one conditional write per change
+relay_mirror = RelayStateMirror(Relay, relays, firebase)
+
+# Internal resistance from current steps; a charger relay switch is a step we
+# caused ourselves, so a smaller current change is accepted right after it
+ir_estimator = InternalResistanceEstimator()
+relay_mirror.on_change.append(
+    lambda gpio, value, source: ir_estimator.expect_step() if gpio == cfg.charger_relay else None)
+
+# Online anomaly detection per channel; a relay switch is an expected step, so the
+# voltage and current baselines jump to the new level instead of raising an alarm
+anomaly_detector = AnomalyDetector(z_threshold=cfg.anomaly_z, cusum_h=cfg.anomaly_cusum_h)
+relay_mirror.on_change.append(
+    lambda gpio, value, source: anomaly_detector.rebaseline(("voltage", "current"), samples=5))
+config.on_change.append(
+    lambda old, new: anomaly_detector.set_sensitivity(new.anomaly_z, new.anomaly_cusum_h))
+
+# Optional raw trace (sensor samples, relay actions, stream events) that
+# trace_replay.py can feed back through the control logic off-site
+recorder = TraceRecorder(cfg.trace_path) if cfg.trace_path else None
+if recorder:
+    recorder.relay_states(relay_mirror.snapshot())
+    relay_mirror.on_change.append(lambda gpio, value, source: recorder.relay(gpio, value, source))
+
+# Voltage trend over the last 30 minutes; a charger switch moves the voltage to
+# another curve, so the fit starts over whenever the charger relay changes, and
+# after a charge (relay ON = charger OFF) only once the voltage has settled
+forecaster = TrendForecaster(window=1800.0)
+relay_mirror.on_change.append(
+    lambda gpio, value, source: forecaster.reset(SETTLE_S if value else 0.0)
+    if gpio == cfg.charger_relay else None)
+
+# Energy in/out, charger duty, relay actuations and uptime as running totals,
+# checkpointed next to this script so they survive restarts and power cuts
+COUNTERS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "bms_counters.json")
+counters = EnergyCounters(COUNTERS_PATH).load()
+relay_mirror.on_change.append(lambda gpio, value, source: counters.count_actuation(gpio))
+
+#%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%  Helper Methods   %%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%
 
 # Sensors and actuators
 def get_timestamp():
@@ -85,31 +187,105 @@ def get_timestamp():
     return int(ireland_time.timestamp())
 
 def read_aht_sensor():
-    humidity = aht20.relative_humidity
-    temperature = bmp280.temperature
-    if humidity is None or temperature is None:
-        print("Sensor read failed")
-        return None, None
+    """
+    Humidity (AHT20) and temperature (BMP280), each None when its read
+    failed, so an I2C error on one sensor never stops the other readings
+    or leaves the previous values standing as if they were live.
+    """
+    try:
+        humidity = aht20.relative_humidity
+    except Exception as e:  # Typically OSError from the I2C bus
+        log_sensors.warning("AHT20 read error: %s", e)
+        humidity = None
+    try:
+        temperature = bmp280.temperature
+    except Exception as e:
+        log_sensors.warning("BMP280 read error: %s", e)
+        temperature = None
     # Round the readings to 2 decimal points
-    humidity = round(humidity, 2)
-    temperature = round(temperature, 2)
+    if humidity is not None:
+        humidity = round(humidity, 2)
+    if temperature is not None:
+        temperature = round(temperature, 2)
     return humidity, temperature
 
 def read_ina_sensor():
+    """
+    Bus voltage (V) and current through the shunt (A, the library reports
+    mA), unrounded and read in one locked transaction so both belong to
+    the same moment; (None, None) if the read fails.
+    """
     if ina is None:
-        return None
+        return None, None
     try:
-        shunt_voltage = round(ina.shunt_voltage(), 2)
-        bus_voltage = round(ina.voltage(), 2)
-        load_voltage = round((bus_voltage + shunt_voltage/1000), 2)
-        return bus_voltage
+        with ina_lock:
+            bus_voltage = ina.voltage()
+            current = ina.current() / 1000
+        return bus_voltage, current
     except DeviceRangeError as e:
-        print(f"INA226 read error: {e}")
-        return None
+        log_sensors.warning("INA226 read error: %s", e)
+        return None, None
     except Exception as e:
-        print(f"General INA226 read error: {e}")
-        return None
-    
+        log_sensors.warning("General INA226 read error: %s", e)
+        return None, None
+
+def read_ina_channels():
+    """
+    Read every INA226 channel unrounded, in capture.CHANNELS order:
+    bus voltage (V), shunt voltage (mV), current (mA), power (mW).
+    """
+    with ina_lock:
+        return ina.voltage(), ina.shunt_voltage(), ina.current(), ina.power()
+
+def set_ina_fast_mode(fast):
+    # Shortest conversion time and no averaging while capturing, defaults otherwise
+    with ina_lock:
+        if fast:
+            ina.configure(avg_mode=INA226.AVG_1BIT, bus_ct=INA226.VCT_140us_BIT,
+                          shunt_ct=INA226.VCT_140us_BIT)
+        else:
+            ina.configure(avg_mode=INA226.AVG_4BIT, bus_ct=INA226.VCT_1100us_BIT,
+                          shunt_ct=INA226.VCT_1100us_BIT)
+
+def upload_and_wait(path, data):
+    # Capture uploads are large and ordered (blob before status), so wait for each
+    return firebase.set(path, data).result(60)
+
+# High-resolution capture runner (one capture at a time, on its own thread)
+capture_recorder = CaptureRecorder(
+    read_ina_channels, upload_and_wait,
+    capture_path=f"/UsersData/{USER_UID}/captures",
+    on_start=lambda: set_ina_fast_mode(True),
+    on_finish=lambda: set_ina_fast_mode(False),
+)
+
+# Readings whose upload failed; re-sent as compressed chunks under .../backfill
+backfill_queue = BackfillQueue(maxlen=20000, chunk_size=1000)
+
+# Every reading goes to each configured output through its own bounded queue
+# and worker thread, so a slow output never delays sampling or the others.
+# Firebase writes are batched into multi-path updates; a batch that still
+# fails after its retries is kept for the next backfill.
+outputs = FanOut()
+outputs.add(FirebaseSink(firebase, f"/UsersData/{USER_UID}/readings"),
+            batch_size=20, max_wait=0.5, retries=3, backoff=(2.0, 30.0),
+            on_give_up=lambda batch: [backfill_queue.add(reading) for reading in batch])
+if cfg.csv_path:
+    try:
+        outputs.add(CsvFileSink(cfg.csv_path), batch_size=100, max_wait=60.0)
+    except OSError:
+        log.exception("CSV output %s could not be opened", cfg.csv_path)
+if cfg.influx_endpoint:
+    influx_host, _, influx_port = cfg.influx_endpoint.rpartition(":")
+    outputs.add(LineProtocolSink(influx_host, int(influx_port), tags={"board": "board1"}),
+                queue_size=20000, batch_size=100, max_wait=5.0, retries=10)
+
+def upload_reading(data):
+    """
+    Hand one reading to every output; never blocks.
+    """
+    outputs.publish(data)
+
 def stream_callback(event):
     """
     Handles changes to the Firebase database path.
@@ -119,10 +295,13 @@ def stream_callback(event):
     - event.data: The data at the event's path
     """
     if event.data is None:
-        print("No data found in the event.")
+        log_relay.info("No data found in the event.")
         return
 
-    print(f"Data: {event.data}")
+    log_relay.info("Data: %s", event.data, extra={"path": event.path})
+
+    if recorder:
+        recorder.firebase(event.event_type, event.path, event.data)
 
     # Parse the event data
     if event.path == "/":  # Root path event with full JSON payload
@@ -132,46 +311,37 @@ def stream_callback(event):
                 gpio = int(gpio)  # Convert GPIO pin key to integer
                 state = int(state)  # Convert state value to integer (0 or 1)
                 if gpio in Relay:
-                    relay_index = Relay.index(gpio)
-                    if state == 1:
-                        relays[relay_index].on()  # Turn the relay ON
-                        manual_override[gpio] = True  # Enable manual override
-                        print(f"GPIO {gpio} set to OFF")
-                    else:
-                        relays[relay_index].off()  # Turn the relay OFF
-                        manual_override[gpio] = True  # Enable manual override
-                        print(f"GPIO {gpio} set to ON")
+                    relay_mirror.apply_remote(gpio, state)  # Drive the relay through the cache
+                    manual_override[gpio] = True  # Enable manual override
+                    log_relay.info("GPIO %s set to %s", gpio, 'OFF' if state == 1 else 'ON')
                 else:
-                    print(f"Invalid GPIO pin: {gpio}")
+                    log_relay.warning("Invalid GPIO pin: %s", gpio)
         except (ValueError, TypeError) as e:
-            print(f"Error parsing JSON data: {e}")
+            log_relay.warning("Error parsing JSON data: %s", e)
 
     elif event.path.startswith("/"):  # Specific GPIO pin event (e.g., /5 or /6)
         try:
             gpio = int(event.path[1:])  # Extract GPIO pin from the path
             state = int(event.data)  # Convert the state value to integer
             if gpio in Relay:
-                relay_index = Relay.index(gpio)
-                if state == 1:
-                    relays[relay_index].on()  # Turn the relay ON
-                    manual_override[gpio] = True  # Enable manual override
-                    print(f"GPIO {gpio} set to OFF")
-                else:
-                    relays[relay_index].off()  # Turn the relay OFF
-                    manual_override[gpio] = True  # Enable manual override
-                    print(f"GPIO {gpio} set to ON")
+                relay_mirror.apply_remote(gpio, state)  # Drive the relay through the cache
+                manual_override[gpio] = True  # Enable manual override
+                log_relay.info("GPIO %s set to %s", gpio, 'OFF' if state == 1 else 'ON')
             else:
-                print(f"Invalid GPIO pin: {gpio}")
+                log_relay.warning("Invalid GPIO pin: %s", gpio)
         except (ValueError, TypeError) as e:
-            print(f"Error processing GPIO update: {e}")
+            log_relay.warning("Error processing GPIO update: %s", e)
 
 def update_relay_states():
     """
-    Update the state of the relays in Firebase.
+    Push relay changes to Firebase.
+    Only relays that changed since the last confirmed write are sent, each as
+    one ETag-conditional write, so dashboard commands in flight are never
+    overwritten (see relay_state.py for the conflict rules).
     """
-    gpio_states = {gpio: (1 if relay.value else 0) for gpio, relay in zip(Relay, relays)}
-    db.reference("board1/outputs/digital").set(gpio_states)
-    print("Relay states updated in Firebase:", gpio_states)
+    changed = relay_mirror.reconcile()
+    if changed:
+        log_relay.info("Relay states queued for Firebase", extra={"relays": {gpio: relay_mirror.value(gpio) for gpio in changed}})
 
 def init_firebase_stream():
     # Firebase Database Reference
@@ -182,99 +352,253 @@ def init_firebase_stream():
             db_ref.listen(stream_callback)
             break  # Exit loop once listener starts successfully
         except ConnectionError as e:
-            print(f"Connection error: {e}")
-            print("Retrying in 5 seconds...")
-            time.sleep(5)  # Retry after 5 seconds
+            log_firebase.warning("Connection error: %s, retrying in 5 seconds...", e)
+            sleep(5)  # Retry after 5 seconds
         except Exception as e:
-            print(f"Unexpected error: {e}")
-            time.sleep(5)  # Retry after 5 seconds
-            
+            log_firebase.warning("Unexpected error: %s", e)
+            sleep(5)  # Retry after 5 seconds
 
+def config_callback(event):
+    """
+    Apply changes to the board1/config node (whole node or single keys).
+    Invalid values are rejected and the current config is kept.
+    """
+    config.apply_remote(event.path, event.data)
 
-#%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%% Logging for debugging   %%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%
+def capture_callback(event):
+    """
+    Start a capture when the dashboard writes board1/capture/request,
+    e.g. {"duration": 10}. The request is cleared once accepted so it does
+    not fire again when the listener reconnects.
+    """
+    if event.data is None or ina is None:
+        return
+    request = event.data if event.path == "/" else {event.path.strip("/"): event.data}
+    if capture_recorder.handle_command(request):
+        log.info("High-resolution capture started", extra={"request": request})
+        firebase.delete("board1/capture/request")
+
+def init_capture_stream():
+    # Listen for capture requests from the dashboard
+    while True:
+        try:
+            db.reference("board1/capture/request").listen(capture_callback)
+            break  # Exit loop once listener starts successfully
+        except Exception as e:
+            log_firebase.warning("Capture listener error: %s", e)
+            sleep(5)  # Retry after 5 seconds
 
-logging.basicConfig(filename='/home/pi/bms.log', level=logging.INFO, format='%(asctime)s - %(message)s')
-logging.info("Battery monitoring started")
+def init_config_stream():
+    # Listen for remote tuning of thresholds, upload delay, shunt, ...
+    while True:
+        try:
+            db.reference("board1/config").listen(config_callback)
+            break  # Exit loop once listener starts successfully
+        except Exception as e:
+            log_firebase.warning("Config listener error: %s", e)
+            sleep(5)  # Retry after 5 seconds
 
 
 #%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%% Main loop processing   %%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%
-def main_loop():
-    last_send_time = time()  # Store the time of the last data upload
 
-    # Define threshold voltage levels
-    LOW_THRESHOLD = 13.2   # Voltage below this turns the charger ON
-    HIGH_THRESHOLD = 14.3  # Voltage above this turns the charger OFF
+# Latest sample shared between the periodic jobs (all run on the main thread)
+# One hour of 1 s samples for /snapshot on the LAN server
+telemetry = TelemetryHub(history=3600)
 
-    charger_on = False  # Track current state of the charger
+latest = {"humidity": None, "temperature": None, "bus_voltage": None, "current": None, "t": None,
+          "tte": None, "ttf": None}
 
-    while True:
-        # Read humidity and temperature from sensors
-        humidity, temperature = read_aht_sensor()
-        
-        # Read bus voltage from INA226 power monitor
-        bus_voltage = read_ina_sensor()
-        
-        # Check if relay 6 is ON (manual override switch)
-        if relays[Relay.index(6)].value:  # Relay is active-high
-            manual_override[5] = False     # Auto-control relay 5 (charger)
-            charger_on = False             # Charger should be OFF in auto
-        else:
-            manual_override[5] = True      # Manual control active
-            charger_on = True              # Charger will be managed manually
-
-        # Auto-control logic when no manual override
-        if not manual_override[5]:
-            if bus_voltage is not None:  # Ensure sensor reading is valid
-                if bus_voltage < LOW_THRESHOLD and not charger_on:
-                    relays[Relay.index(5)].off()  # Turn ON charger (relay active-low)
-                    charger_on = True
-                    # logging.info("Battery voltage low. Charger ON.")
-                elif bus_voltage > HIGH_THRESHOLD and charger_on:
-                    relays[Relay.index(5)].on()   # Turn OFF charger
-                    charger_on = False
-                    # logging.info("Battery voltage high. Charger OFF.")
-
-        # Upload data every `timer_delay` seconds
-        if time() - last_send_time > timer_delay:
-            last_send_time = time()  # Reset timer
-            timestamp = get_timestamp()  # Get current timestamp
-
-            # Upload if all sensor readings are valid
-            if humidity and temperature and bus_voltage:
-                data = {
-                    "temperature": temperature,
-                    "humidity": humidity,
-                    "voltage": bus_voltage,
-                    "timestamp": timestamp,
-                }
-
-                # Upload sensor data to Firebase under user path
-                ref_path = f"/UsersData/{USER_UID}/readings/{timestamp}"
-                db.reference(ref_path).set(data)
-
-                print("Data uploaded:", data)
-
-                # Upload relay states
-                update_relay_states()
-
-                # Additional real-time feedback in terminal
-                print(f"Bus Voltage: {ina.voltage():.2f} V")
-                print(f"Shunt Voltage: {ina.shunt_voltage():.2f} V")
-                print(f"Current: {ina.current():.2f} A")
-                print(f"Power: {ina.power():.2f} W")
-            else:
-                print("Sensor read failed")
-        
-        sleep(1)  # Small delay to reduce CPU usage
+def sample_job():
+    """
+    Read every sensor once per tick. Each read returns None for a channel
+    that failed, so control and upload skip it instead of reusing the
+    previous tick's value.
+    """
+    latest["humidity"], latest["temperature"] = read_aht_sensor()  # Humidity and temperature
+    bus_voltage, current = read_ina_sensor()  # Bus voltage and current from INA226 power monitor
+    latest["bus_voltage"] = None if bus_voltage is None else round(bus_voltage, 2)
+    latest["current"] = current
+    latest["t"] = monotonic()
+    if recorder:
+        recorder.sensor(latest["bus_voltage"], latest["current"], latest["temperature"], latest["humidity"])
+
+    # Local dashboards get every sample; publish() only queues, it never waits on clients
+    telemetry.publish({"timestamp": get_timestamp(), "voltage": latest["bus_voltage"],
+                       "current": latest["current"], "temperature": latest["temperature"],
+                       "humidity": latest["humidity"], "relays": relay_mirror.snapshot()})
+
+    # Internal resistance from voltage/current steps (cheap, every sample); fed the
+    # unrounded voltage, since dV of a 0.5 A step is only ~10 mV on a 20 mOhm pack
+    ir_estimator.update(bus_voltage, current, latest["t"])
+
+    forecaster.update(latest["t"], latest["bus_voltage"])
+
+    # Energy and charger duty (relay OFF = charger ON)
+    counters.add_sample(latest["bus_voltage"], latest["current"], latest["t"],
+                        not relay_mirror.value(config.current.charger_relay))
+
+    # Abnormal patterns (loose terminal, failing charger, shorted cell) long before
+    # a threshold trips; events go straight into the upload stream
+    for event in anomaly_detector.update({"voltage": latest["bus_voltage"], "current": latest["current"],
+                                          "temperature": latest["temperature"],
+                                          "humidity": latest["humidity"]}, get_timestamp()):
+        log_anomaly.warning("Anomaly: %s %s (z=%.1f)", event["channel"], event["kind"], event["z"],
+                            extra={"anomaly": event})
+        firebase.set(f"/UsersData/{USER_UID}/anomalies/{event['t']}_{event['channel']}", event)
+
+def control_job():
+    """
+    Charger control and relay write-back, right after each sample.
+    """
+    cfg = config.current  # One consistent snapshot for this tick
+    bus_voltage = latest["bus_voltage"]
+
+    # Forecasts: time to LOW_THRESHOLD while discharging, to HIGH_THRESHOLD while charging
+    charging = not relay_mirror.value(cfg.charger_relay)  # Relay OFF = charger ON
+    latest["tte"] = None if charging else forecaster.time_to(cfg.low_threshold)
+    latest["ttf"] = forecaster.time_to(cfg.high_threshold) if charging else None
+
+    # Check if relay 6 is ON (manual override switch)
+    if relay_mirror.value(cfg.override_relay):  # Relay is active-high
+        manual_override[cfg.charger_relay] = False     # Auto-control relay 5 (charger)
+    else:
+        manual_override[cfg.charger_relay] = True      # Manual control active
+
+    # Auto-control logic when no manual override
+    if not manual_override[cfg.charger_relay]:
+        # Charger state follows the relay (active-low: relay OFF = charger ON), so it
+        # carries over between passes and the high threshold can switch it off again
+        charger_on = not relay_mirror.value(cfg.charger_relay)
+        # With preemptive_lead_s set, the charger also starts that long before the forecast crossing
+        if charger_decision(bus_voltage, charger_on, cfg.low_threshold, cfg.high_threshold,
+                            latest["tte"], cfg.preemptive_lead_s) != charger_on:
+            charger_on = not charger_on
+            relay_mirror.set_local(cfg.charger_relay, 0 if charger_on else 1)  # Relay OFF = charger ON
+
+    # Write back relay changes (no-op when nothing changed)
+    update_relay_states()
+
+def upload_job():
+    """
+    Upload the latest reading every `timer_delay` seconds.
+    """
+    timestamp = get_timestamp()  # Wall-clock timestamp, used only as the record key
+    humidity, temperature = latest["humidity"], latest["temperature"]
+    bus_voltage, current = latest["bus_voltage"], latest["current"]
+
+    # Upload if all sensor readings are valid
+    if humidity and temperature and bus_voltage:
+        data = {
+            "temperature": temperature,
+            "humidity": humidity,
+            "voltage": bus_voltage,
+            "timestamp": timestamp,
+        }
+        if current is not None:
+            data["current"] = round(current, 2)
+
+        # Internal resistance (milliohms) with its 95 % confidence interval
+        interval = ir_estimator.confidence_interval()
+        if interval is not None:
+            data["ir_mohm"] = round(ir_estimator.estimate * 1000, 2)
+            data["ir_ci_mohm"] = round((interval[1] - interval[0]) * 500, 2)
+
+        # Forecast seconds until LOW_THRESHOLD (discharging) / HIGH_THRESHOLD (charging)
+        if latest["tte"] is not None:
+            data["tte_s"] = int(latest["tte"])
+        if latest["ttf"] is not None:
+            data["ttf_s"] = int(latest["ttf"])
+
+        # Upload sensor data to Firebase under user path
+        upload_reading(data)
+
+        log.info("Data uploaded", extra={"reading": data})
+
+        # Additional real-time feedback (library units: V, mV, mA, mW)
+        bus_v, shunt_mv, current_ma, power_mw = read_ina_channels()
+        log_sensors.info("INA226 Bus %.2f V, Shunt %.2f mV, Current %.2f mA, Power %.2f mW",
+                         bus_v, shunt_mv, current_ma, power_mw)
+    else:
+        log_sensors.warning("Sensor read failed")
+
+def backfill_job():
+    """
+    Push readings missed during an outage as compressed chunks.
+    """
+    if len(backfill_queue):
+        sent = backfill_queue.flush(firebase.update, f"/UsersData/{USER_UID}/backfill")
+        if sent:
+            log_firebase.info("Backfilling %d readings", sent)
+
+def counters_job():
+    """
+    Checkpoint the running totals; after midnight upload the finished day.
+    """
+    counters.roll_day()
+    counters.checkpoint()
+    for day, summary in counters.summary_unsent().items():
+        future = firebase.set(f"/UsersData/{USER_UID}/daily/{day}", summary)
+        future.add_done_callback(
+            lambda f, day=day: counters.mark_sent(day) if not f.cancelled() and f.exception() is None else None)
+
+def config_job():
+    # Pick up edits to bms_config.json (one stat call when nothing changed)
+    config.reload_if_changed()
+
+# Fixed-rate scheduler on the monotonic clock: work time does not stretch the
+# period, wall-clock/NTP steps cannot skip or double an upload, overruns are logged.
+# Jobs due on the same tick run in priority order (lower first).
+scheduler = TickScheduler()
+scheduler.add_job("sample", 1.0, sample_job, priority=0)
+scheduler.add_job("control", 1.0, control_job, priority=1)
+scheduler.add_job("upload", cfg.timer_delay, upload_job, priority=2, offset_s=cfg.timer_delay)
+scheduler.add_job("backfill", 60.0, backfill_job, priority=3, offset_s=30.0)
+scheduler.add_job("config", 5.0, config_job, priority=4)
+scheduler.add_job("counters", 60.0, counters_job, priority=5, offset_s=15.0)
+
+def apply_upload_period(old, new):
+    if new.timer_delay != old.timer_delay:
+        scheduler.set_period("upload", new.timer_delay)
+
+config.on_change.append(apply_upload_period)
+
+def main_loop():
+    scheduler.run()  # Runs the jobs above until scheduler.stop()
 
 # Entry point of the program
 if __name__ == "__main__":
     # Start Firebase listener in a separate thread
-    stream_thread = threading.Thread(target=init_firebase_stream)
+    stream_thread = threading.Thread(target=init_firebase_stream, name="firebase-stream")
     stream_thread.daemon = True  # Ensure thread exits when main program exits
     stream_thread.start()
 
-    print("Listening for Firebase changes...")
+    # Start the remote config listener in its own thread
+    config_thread = threading.Thread(target=init_config_stream, name="config-stream")
+    config_thread.daemon = True
+    config_thread.start()
+
+    # Start the capture request listener in its own thread
+    capture_thread = threading.Thread(target=init_capture_stream, name="capture-stream")
+    capture_thread.daemon = True
+    capture_thread.start()
+
+    # Serve the live sample feed on the LAN (port 0 in the config disables it)
+    if cfg.lan_port:
+        try:
+            LanTelemetryServer(telemetry, port=cfg.lan_port).start()
+        except OSError:
+            log.exception("LAN telemetry server could not start")
+
+    # Profiling on demand (kill -USR1 <pid>, or python profiling_hooks.py profile 60);
+    # costs nothing until triggered, and charging control keeps running meanwhile
+    profiler = StackSampler('/home/pi/profiles')
+    install_signal_handler(profiler, duration=30)
+    try:
+        ControlSocket(profiler).start()
+    except OSError:
+        log.exception("Profiler control socket could not start")
+
+    log.info("Listening for Firebase changes...")
 
     # Run main monitoring loop continuously
     while True:
@@ -282,12 +606,14 @@ if __name__ == "__main__":
             main_loop()  # Launch main battery management logic
         except KeyboardInterrupt:
             # Handle Ctrl+C gracefully
-            print("Exiting by user...")
+            log.info("Exiting by user...")
             break
         except Exception as e:
             # Catch other errors and attempt restart
-            print(f"Error in main loop: {e}")
-            print("Restarting main_loop in 5 seconds...")
-            time.sleep(5)
+            log.exception("Error in main loop, restarting in 5 seconds...")
+            sleep(5)
+
+    outputs.close(timeout=5.0)  # Deliver what the outputs can take before exiting
+    log_listener.stop()  # Flush queued records to disk
 
 
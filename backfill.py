@@ -0,0 +1,232 @@
+# Compact chunk encoding for backfilling readings
+#
+# Instead of one JSON node per timestamp, a run of readings is packed into a
+# single chunk node:
+#   - columns (timestamp, temperature, humidity, voltage, ...) stored apart
+#   - each value scaled to an integer (readings are rounded to 2 decimals)
+#   - first differences, zigzag + varint encoded
+#   - zlib (or LZ4 when the lz4 package is installed) and base64
+# Chunks live under {base}/chunks/{first timestamp} with a small entry in
+# {base}/index/{first timestamp}; both are written by one multi-path update.
+#
+# Decode an exported backfill node offline:
+#   python backfill.py backfill.json > readings.csv
+import sys  # CLI output
+import csv  # CLI output
+import json  # CLI input
+import zlib  # Default codec
+import base64  # Firebase nodes hold text, not bytes
+import threading  # Uploads fail on the client thread, flushes run from main_loop
+import logging  # Report flushes
+from collections import deque  # Bounded outage buffer
+
+try:
+    import lz4.frame  # Optional faster codec
+except ImportError:
+    lz4 = None
+
+log = logging.getLogger("bms.backfill")
+
+SCALE = 100  # Two decimal places
+
+
+#%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%  Integer coding   %%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%
+
+def _put_varint(out, value):
+    value = (value << 1) ^ (value >> 63)  # Zigzag: small negatives stay small
+    while value > 0x7F:
+        out.append((value & 0x7F) | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+def _get_varints(data, count, pos):
+    values = []
+    for _ in range(count):
+        shift = result = 0
+        while True:
+            byte = data[pos]
+            pos += 1
+            result |= (byte & 0x7F) << shift
+            if byte < 0x80:
+                break
+            shift += 7
+        values.append((result >> 1) ^ -(result & 1))
+    return values, pos
+
+
+def _compress(raw, codec):
+    if codec == "lz4":
+        if lz4 is None:
+            raise ValueError("lz4 codec requested but the lz4 package is not installed")
+        return lz4.frame.compress(raw)
+    return zlib.compress(raw, 9)
+
+
+def _decompress(blob, codec):
+    if codec == "lz4":
+        if lz4 is None:
+            raise ValueError("lz4 package is needed to decode this chunk")
+        return lz4.frame.decompress(blob)
+    return zlib.decompress(blob)
+
+
+#%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%  Chunk encoder / decoder   %%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%
+
+def common_fields(readings):
+    """
+    Numeric fields present in every reading (optional ones such as current
+    are only kept for chunks where no reading misses them).
+    """
+    names = set(readings[0]) - {"timestamp"}
+    for reading in readings:
+        names &= {name for name, value in reading.items()
+                  if isinstance(value, (int, float)) and not isinstance(value, bool)}
+    return tuple(sorted(names))
+
+
+def encode_chunk(readings, fields=None, scale=SCALE, codec="zlib"):
+    """
+    Pack readings (dicts with "timestamp" and every name in fields) into
+    one chunk node. Readings are sorted by timestamp first; fields defaults
+    to common_fields(readings).
+    """
+    if not readings:
+        raise ValueError("Cannot encode an empty chunk")
+    readings = sorted(readings, key=lambda r: r["timestamp"])
+    if fields is None:
+        fields = common_fields(readings)
+    raw = bytearray()
+    columns = [[int(r["timestamp"]) for r in readings]]
+    for name in fields:
+        try:
+            columns.append([round(r[name] * scale) for r in readings])
+        except (KeyError, TypeError):
+            raise ValueError(f"Every reading needs a numeric {name!r}")
+    for column in columns:
+        previous = 0
+        for value in column:
+            _put_varint(raw, value - previous)
+            previous = value
+    return {
+        "codec": codec,
+        "count": len(readings),
+        "first": columns[0][0],
+        "last": columns[0][-1],
+        "fields": list(fields),
+        "scale": scale,
+        "data": base64.b64encode(_compress(bytes(raw), codec)).decode("ascii"),
+    }
+
+
+def decode_chunk(node):
+    """
+    Inverse of encode_chunk: returns the list of reading dicts.
+    """
+    raw = _decompress(base64.b64decode(node["data"]), node["codec"])
+    count, scale = node["count"], node["scale"]
+    columns = []
+    pos = 0
+    for _ in range(len(node["fields"]) + 1):
+        deltas, pos = _get_varints(raw, count, pos)
+        column = []
+        total = 0
+        for delta in deltas:
+            total += delta
+            column.append(total)
+        columns.append(column)
+    readings = []
+    for i, timestamp in enumerate(columns[0]):
+        reading = {name: column[i] / scale for name, column in zip(node["fields"], columns[1:])}
+        reading["timestamp"] = timestamp
+        readings.append(reading)
+    return readings
+
+
+def chunk_update(readings, chunk_size=1000, codec="zlib"):
+    """
+    Build one multi-path update for the backfill node: every chunk and its
+    index entry, so a chunk is never visible without its index (or vice versa).
+    """
+    readings = sorted(readings, key=lambda r: r["timestamp"])
+    update = {}
+    for start in range(0, len(readings), chunk_size):
+        node = encode_chunk(readings[start:start + chunk_size], codec=codec)
+        key = str(node["first"])
+        update[f"chunks/{key}"] = node
+        update[f"index/{key}"] = {"first": node["first"], "last": node["last"],
+                                  "count": node["count"], "bytes": len(node["data"])}
+    return update
+
+
+def decode_backfill(tree):
+    """
+    Yield readings in time order from an exported backfill node
+    ({"chunks": {...}, "index": {...}}).
+    """
+    chunks = tree.get("chunks", {})
+    for key in sorted(chunks, key=int):
+        yield from decode_chunk(chunks[key])
+
+
+#%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%  Outage buffer   %%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%
+
+class BackfillQueue:
+    """
+    Holds readings whose upload failed and pushes them later as chunks.
+    - maxlen bounds memory; the oldest readings are dropped first
+    """
+    def __init__(self, maxlen=20000, chunk_size=1000, codec="zlib"):
+        self.readings = deque(maxlen=maxlen)
+        self.chunk_size = chunk_size
+        self.codec = codec
+        self.lock = threading.Lock()
+        self.flushing = False
+
+    def __len__(self):
+        return len(self.readings)
+
+    def add(self, reading):
+        with self.lock:
+            self.readings.append(reading)
+
+    def flush(self, update, base_path):
+        """
+        Send everything queued as one multi-path update via update(path, data),
+        which must return a concurrent.futures.Future. Readings are put back
+        if the write fails. Returns the number of readings sent.
+        """
+        with self.lock:
+            if self.flushing or not self.readings:
+                return 0
+            batch = list(self.readings)
+            self.readings.clear()
+            self.flushing = True
+        future = update(base_path, chunk_update(batch, self.chunk_size, self.codec))
+        future.add_done_callback(lambda f: self._done(f, batch))
+        return len(batch)
+
+    def _done(self, future, batch):
+        with self.lock:
+            self.flushing = False
+            if future.cancelled() or future.exception() is not None:
+                # Put them back in front of anything queued meanwhile; when
+                # that overflows maxlen the oldest go, as with add()
+                merged = deque(batch, maxlen=self.readings.maxlen)
+                merged.extend(self.readings)
+                self.readings = merged
+                return
+        log.info("Backfilled %d readings", len(batch))
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 2:
+        print("Usage: python backfill.py <exported backfill node .json>")
+        sys.exit(1)
+    with open(sys.argv[1]) as f:
+        tree = json.load(f)
+    fields = sorted({name for chunk in tree.get("chunks", {}).values() for name in chunk["fields"]})
+    writer = csv.writer(sys.stdout)
+    writer.writerow(["timestamp"] + fields)
+    for reading in decode_backfill(tree):
+        writer.writerow([reading["timestamp"]] + [reading.get(name, "") for name in fields])
@@ -0,0 +1,68 @@
+# Benchmark: blocking per-call uploads vs. the pooled async Firebase client
+#
+# Both paths write the same reading payloads to a local fake_rtdb server.
+# --latency adds a per-request delay to stand in for the Pi's network
+# round trip, which is where the sync path spends most of its time.
+#
+#   python bench_firebase.py --requests 500 --latency 0.02
+import asyncio
+import argparse
+import http.client
+import json
+from time import perf_counter
+from urllib.parse import urlsplit
+
+from fake_rtdb import FakeRealtimeDatabase
+from firebase_client import AsyncFirebaseClient
+
+
+def sample_payload(i):
+    return {"temperature": 21.5, "humidity": 48.1, "voltage": 13.42, "timestamp": 1700000000 + i}
+
+
+def bench_sync(url, count):
+    # Mirrors db.reference(path).set(data): one blocking request at a time
+    # on the calling thread (keep-alive, as firebase_admin's session does)
+    parts = urlsplit(url)
+    conn = http.client.HTTPConnection(parts.hostname, parts.port)
+    start = perf_counter()
+    for i in range(count):
+        body = json.dumps(sample_payload(i))
+        conn.request("PUT", f"/bench/sync/{i}.json", body, {"Content-Type": "application/json"})
+        conn.getresponse().read()
+    elapsed = perf_counter() - start
+    conn.close()
+    return elapsed
+
+
+async def bench_async(url, count, connections, pipelined):
+    client = AsyncFirebaseClient(url, max_connections=connections)
+    start = perf_counter()
+    if pipelined:
+        await client.pipeline([("PUT", f"bench/pipe/{i}", sample_payload(i)) for i in range(count)])
+    else:
+        await asyncio.gather(*(client.set(f"bench/async/{i}", sample_payload(i)) for i in range(count)))
+    elapsed = perf_counter() - start
+    await client.close()
+    return elapsed
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Firebase upload path benchmark")
+    parser.add_argument("--requests", type=int, default=500)
+    parser.add_argument("--connections", type=int, default=8)
+    parser.add_argument("--latency", type=float, default=0.02, help="Simulated round trip (s)")
+    args = parser.parse_args()
+
+    with FakeRealtimeDatabase(latency=args.latency) as fake:
+        results = [
+            ("sync (current path)", bench_sync(fake.url, args.requests)),
+            (f"async x{args.connections}", asyncio.run(
+                bench_async(fake.url, args.requests, args.connections, False))),
+            (f"async x{args.connections} pipelined", asyncio.run(
+                bench_async(fake.url, args.requests, args.connections, True))),
+        ]
+
+    print(f"{args.requests} writes, {args.latency * 1000:.0f} ms simulated latency")
+    for name, elapsed in results:
+        print(f"{name:<28} {args.requests / elapsed:10.1f} req/s  ({elapsed:.2f} s)")
@@ -0,0 +1,242 @@
+# Offline battery-health analytics over archived readings
+#
+# Streams CSV exports (one file per pack, header row with at least
+# timestamp and voltage; current in A and temperature in C are optional)
+# in fixed-size chunks and computes with vectorised NumPy operations:
+#   - charge-cycle segmentation with the charger hysteresis (13.2 / 14.3 V)
+#   - charge / discharge Ah per cycle (needs current, positive = charging);
+#     the discharge Ah between thresholds is the usable-capacity estimate
+#   - time spent in each voltage band
+#   - temperature-weighted (Arrhenius) equivalent ageing hours
+# Only one chunk plus a few per-cycle numbers are held in memory per pack.
+#
+#   python bms_analytics.py pack1.csv pack2.csv.gz --json report.json
+import os  # Pack names from file names
+import gzip  # Compressed exports
+import json  # --json report
+import argparse  # Command line options
+from itertools import islice  # Read files chunk by chunk
+from datetime import datetime, timezone
+
+import numpy as np
+
+from bms_config import BMSConfig  # Default thresholds match the controller
+
+GAS_CONSTANT = 8.314  # J/(mol K)
+DEFAULT_BANDS = (11.5, 12.0, 12.5, 13.2, 13.8, 14.3, 14.8)  # Volts
+
+
+#%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%  Chunked CSV reader   %%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%
+
+def read_chunks(path, chunk_rows=1000000, columns=("timestamp", "voltage", "current", "temperature")):
+    """
+    Yield dicts of float arrays, chunk_rows rows at a time.
+    Columns missing from the file are simply absent from the dicts.
+    """
+    opener = gzip.open if path.endswith(".gz") else open
+    with opener(path, "rt") as f:
+        header = [name.strip() for name in f.readline().split(",")]
+        if "timestamp" not in header or "voltage" not in header:
+            raise ValueError(f"{path}: needs timestamp and voltage columns, got {header}")
+        wanted = [name for name in columns if name in header]
+        usecols = [header.index(name) for name in wanted]
+        while True:
+            lines = list(islice(f, chunk_rows))
+            if not lines:
+                return
+            try:
+                data = np.loadtxt(lines, delimiter=",", usecols=usecols, ndmin=2)
+            except ValueError:
+                # Empty fields somewhere in this chunk: slower parser that fills NaN
+                data = np.genfromtxt(lines, delimiter=",", usecols=usecols, ndmin=2)
+            yield {name: data[:, i] for i, name in enumerate(wanted)}
+
+
+#%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%  Per-pack accumulator   %%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%
+
+class PackStats:
+    """
+    Incremental statistics for one pack, fed chunk by chunk in time order.
+    The last row of every chunk is carried into the next one so intervals
+    that straddle a chunk boundary are counted exactly once.
+    - max_gap: intervals longer than this (s) are outages and carry no weight
+    - activation_energy: J/mol for the Arrhenius ageing factor
+    - reference_temp: C at which one hour counts as one ageing hour
+    """
+    def __init__(self, low, high, bands=DEFAULT_BANDS, max_gap=300,
+                 activation_energy=50000.0, reference_temp=25.0):
+        self.low = low
+        self.high = high
+        self.edges = np.concatenate(([-np.inf], bands, [np.inf]))
+        self.max_gap = max_gap
+        self.ea = activation_energy
+        self.t_ref = reference_temp + 273.15
+        self.band_seconds = np.zeros(len(self.edges) - 1)
+        self.total_seconds = 0.0
+        self.aged_seconds = 0.0
+        self.temp_seconds = 0.0  # Time with a valid temperature
+        self.samples = 0
+        self.first_time = None
+        self.last_row = None  # Carried row {name: float}
+        self.state = None  # 1 charging, 0 discharging / resting
+        self.segments = []  # Closed [state, start, end, ah]
+        self.open_segment = None
+
+    def feed(self, chunk):
+        n_new = len(chunk["timestamp"])
+        if n_new == 0:
+            return
+        self.samples += n_new
+        if self.first_time is None:
+            self.first_time = float(chunk["timestamp"][0])
+        if self.last_row is not None:
+            chunk = {name: np.concatenate(([self.last_row[name]], values))
+                     for name, values in chunk.items() if name in self.last_row}
+        self.last_row = {name: float(values[-1]) for name, values in chunk.items()}
+        t = chunk["timestamp"]
+        v = chunk["voltage"]
+        n = len(t)
+
+        # Charger hysteresis: 1 below low, 0 above high, otherwise hold
+        events = np.full(n, -1, dtype=np.int8)
+        events[v < self.low] = 1
+        events[v > self.high] = 0
+        if events[0] < 0:
+            events[0] = self.state if self.state is not None else 0
+        hold = np.where(events >= 0, np.arange(n), 0)
+        np.maximum.accumulate(hold, out=hold)
+        states = events[hold]
+        self.state = int(states[-1])
+        if n < 2:
+            return
+
+        # Interval weights (value at the start of each interval)
+        dt = np.diff(t)
+        weights = np.where((dt > 0) & (dt <= self.max_gap), dt, 0.0)
+        self.total_seconds += weights.sum()
+        self.band_seconds += np.histogram(v[:-1], bins=self.edges, weights=weights)[0]
+
+        if "temperature" in chunk:
+            temp = chunk["temperature"][:-1]
+            valid = ~np.isnan(temp)
+            factor = np.exp(self.ea / GAS_CONSTANT * (1.0 / self.t_ref - 1.0 / (temp[valid] + 273.15)))
+            self.aged_seconds += (factor * weights[valid]).sum()
+            self.temp_seconds += weights[valid].sum()
+
+        # Segments of constant charger state over the intervals
+        interval_states = states[:-1]
+        starts = np.flatnonzero(np.diff(interval_states)) + 1
+        seg_ids = np.zeros(n - 1, dtype=np.int64)
+        seg_ids[starts] = 1
+        np.cumsum(seg_ids, out=seg_ids)
+        if "current" in chunk:
+            current = np.nan_to_num(chunk["current"][:-1])
+            ah = np.bincount(seg_ids, weights=current * weights) / 3600.0
+        else:
+            ah = np.full(seg_ids[-1] + 1, np.nan)
+        seg_states = interval_states[np.concatenate(([0], starts))]
+        seg_starts = t[np.concatenate(([0], starts))]
+        seg_ends = np.append(seg_starts[1:], t[-1])
+
+        for state, start, end, amp_hours in zip(seg_states, seg_starts, seg_ends, ah):
+            segment = self.open_segment
+            if segment is not None and segment[0] == state:
+                segment[2] = float(end)  # Continues across the chunk boundary
+                segment[3] += amp_hours
+                continue
+            if segment is not None:
+                self.segments.append(segment)
+            self.open_segment = [int(state), float(start), float(end), float(amp_hours)]
+
+    def cycles(self):
+        """
+        Pair every charge segment with the discharge segment that follows it.
+        A cycle is "complete" only when both segments run threshold to
+        threshold: the first segment of the data started part-way, and the
+        still-open last segment has not ended yet.
+        """
+        closed = len(self.segments)
+        segments = self.segments + ([self.open_segment] if self.open_segment else [])
+        cycles = []
+        for i, (state, start, end, amp_hours) in enumerate(segments):
+            if state != 1:
+                continue
+            cycle = {"start": start, "charge_hours": (end - start) / 3600.0,
+                     "charge_ah": amp_hours, "discharge_hours": None, "discharge_ah": None,
+                     "complete": 0 < i and i + 1 < closed}
+            if i + 1 < len(segments):
+                _, d_start, d_end, d_ah = segments[i + 1]
+                cycle["discharge_hours"] = (d_end - d_start) / 3600.0
+                cycle["discharge_ah"] = -d_ah
+            cycles.append(cycle)
+        return cycles
+
+    def report(self):
+        cycles = self.cycles()
+        # Partial cycles at either end of the export would read as lost capacity
+        capacities = np.array([c["discharge_ah"] for c in cycles
+                               if c["complete"] and not np.isnan(c["discharge_ah"])])
+        fade = None
+        if len(capacities) >= 3 and capacities[0] > 0:
+            slope = np.polyfit(np.arange(len(capacities)), capacities, 1)[0]
+            fade = 100.0 * slope * 100 / capacities[0]  # % of first capacity per 100 cycles
+        labels = [f"{lo:g}-{hi:g} V" for lo, hi in zip(self.edges[:-1], self.edges[1:])]
+        return {
+            "samples": self.samples,
+            "hours": self.total_seconds / 3600.0,
+            "cycles": len(cycles),
+            "cycle_detail": cycles,
+            "capacity_ah_mean": float(capacities.mean()) if len(capacities) else None,
+            "capacity_fade_pct_per_100_cycles": fade,
+            "band_hours": {label: secs / 3600.0 for label, secs in zip(labels, self.band_seconds)},
+            "ageing_hours_at_ref": self.aged_seconds / 3600.0 if self.temp_seconds else None,
+            "ageing_factor": self.aged_seconds / self.temp_seconds if self.temp_seconds else None,
+        }
+
+
+def analyse_file(path, args):
+    stats = PackStats(args.low, args.high, max_gap=args.max_gap,
+                      activation_energy=args.activation_energy, reference_temp=args.reference_temp)
+    for chunk in read_chunks(path, args.chunk_rows):
+        stats.feed(chunk)
+    return stats.report()
+
+
+def print_report(pack, report):
+    print(f"== {pack}: {report['samples']} samples over {report['hours']:.1f} h")
+    print(f"   cycles: {report['cycles']}")
+    if report["capacity_ah_mean"] is not None:
+        print(f"   usable capacity (mean): {report['capacity_ah_mean']:.2f} Ah")
+    if report["capacity_fade_pct_per_100_cycles"] is not None:
+        print(f"   capacity fade: {report['capacity_fade_pct_per_100_cycles']:.2f} % per 100 cycles")
+    if report["ageing_factor"] is not None:
+        print(f"   ageing: {report['ageing_hours_at_ref']:.1f} equivalent hours "
+              f"(x{report['ageing_factor']:.2f} vs reference temperature)")
+    for label, hours in report["band_hours"].items():
+        print(f"   {label:>14}: {hours:10.1f} h")
+    for cycle in report["cycle_detail"][-5:]:
+        start = datetime.fromtimestamp(cycle["start"], timezone.utc).strftime("%Y-%m-%d %H:%M")
+        print(f"   cycle {start}: charge {cycle['charge_hours']:.1f} h / {cycle['charge_ah']:.2f} Ah")
+
+
+if __name__ == "__main__":
+    defaults = BMSConfig()
+    parser = argparse.ArgumentParser(description="Battery health analytics over exported readings")
+    parser.add_argument("files", nargs="+", help="CSV exports, one per pack (.csv or .csv.gz)")
+    parser.add_argument("--low", type=float, default=defaults.low_threshold)
+    parser.add_argument("--high", type=float, default=defaults.high_threshold)
+    parser.add_argument("--chunk-rows", type=int, default=1000000, help="Rows held in memory at once")
+    parser.add_argument("--max-gap", type=float, default=300, help="Longer gaps (s) are outages")
+    parser.add_argument("--activation-energy", type=float, default=50000.0, help="J/mol")
+    parser.add_argument("--reference-temp", type=float, default=25.0, help="C")
+    parser.add_argument("--json", help="Also write the full report to this file")
+    args = parser.parse_args()
+
+    reports = {}
+    for path in args.files:
+        pack = os.path.basename(path).split(".")[0]
+        reports[pack] = analyse_file(path, args)
+        print_report(pack, reports[pack])
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(reports, f, indent=2)
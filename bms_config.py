@@ -0,0 +1,218 @@
+# Runtime configuration for the battery management system
+#
+# Values are layered defaults < local JSON file < Firebase config node.
+# Every change is validated as a whole and swapped in with a single
+# reference assignment, so main_loop always sees one consistent BMSConfig
+# and never needs a restart (or a Firebase re-auth) for tuning.
+import json  # Config file / Firebase node format
+import os  # File modification time for hot reload
+import threading  # Listener thread and main loop both apply changes
+import logging  # Report rejected or applied changes
+from dataclasses import dataclass, fields, replace, asdict
+
+log = logging.getLogger("bms.config")
+
+
+#%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%  Typed configuration   %%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%
+
+@dataclass(frozen=True)
+class BMSConfig:
+    low_threshold: float = 13.2  # Voltage below this turns the charger ON
+    high_threshold: float = 14.3  # Voltage above this turns the charger OFF
+    timer_delay: float = 18.0  # Seconds between Firebase uploads
+    shunt_ohms: float = 0.352  # INA226 shunt resistor (0.15 on the V1 board)
+    sea_level_pressure: float = 1013.25  # BMP280 altitude compensation (hPa)
+    relay_pins: tuple = (5, 6, 13)  # GPIO pins driving the relays
+    charger_relay: int = 5  # Relay switching the charger
+    override_relay: int = 6  # Relay acting as the manual override switch
+    ina226_address: int = 0x40  # I2C address of the INA226
+    bmp280_address: int = 0x77  # I2C address of the BMP280
+    lan_port: int = 8080  # LAN telemetry stream (0 disables it)
+    anomaly_z: float = 5.0  # Spike alarm level in standard deviations (lower = more sensitive)
+    anomaly_cusum_h: float = 12.0  # Shift/drift alarm level (CUSUM, standard deviations)
+    preemptive_lead_s: float = 0.0  # Start charging this long before the forecast low crossing (0 = off)
+    trace_path: str = ""  # Record raw samples / relay actions / stream events here for replay ("" = off)
+    csv_path: str = ""  # Also append every reading to this CSV file ("" = off)
+    influx_endpoint: str = ""  # "host:port" of an InfluxDB line-protocol TCP listener ("" = off)
+
+    # Hardware objects are built once at start-up from these fields
+    RESTART_ONLY = ("relay_pins", "charger_relay", "override_relay",
+                    "ina226_address", "bmp280_address", "lan_port", "trace_path",
+                    "csv_path", "influx_endpoint")
+
+    def validate(self):
+        """
+        Raise ValueError describing the first invalid setting.
+        """
+        for name in ("low_threshold", "high_threshold", "timer_delay",
+                     "shunt_ohms", "sea_level_pressure", "anomaly_z", "anomaly_cusum_h"):
+            value = getattr(self, name)
+            if not isinstance(value, (int, float)) or isinstance(value, bool) or value <= 0:
+                raise ValueError(f"{name} must be a positive number, got {value!r}")
+        if self.low_threshold >= self.high_threshold:
+            raise ValueError(f"low_threshold ({self.low_threshold}) must be below "
+                             f"high_threshold ({self.high_threshold})")
+        if not self.relay_pins or len(set(self.relay_pins)) != len(self.relay_pins):
+            raise ValueError(f"relay_pins must be unique GPIO numbers, got {self.relay_pins!r}")
+        for name in ("charger_relay", "override_relay"):
+            if getattr(self, name) not in self.relay_pins:
+                raise ValueError(f"{name} ({getattr(self, name)}) is not in relay_pins")
+        for name in ("ina226_address", "bmp280_address"):
+            value = getattr(self, name)
+            if not isinstance(value, int) or not 0x03 <= value <= 0x77:
+                raise ValueError(f"{name} must be a 7-bit I2C address, got {value!r}")
+        if not isinstance(self.preemptive_lead_s, (int, float)) or self.preemptive_lead_s < 0:
+            raise ValueError(f"preemptive_lead_s must be zero or a positive number, got {self.preemptive_lead_s!r}")
+        if not isinstance(self.trace_path, str):
+            raise ValueError(f"trace_path must be a file path or empty, got {self.trace_path!r}")
+        if not isinstance(self.csv_path, str):
+            raise ValueError(f"csv_path must be a file path or empty, got {self.csv_path!r}")
+        host, _, port = str(self.influx_endpoint).rpartition(":")
+        if not isinstance(self.influx_endpoint, str) or (
+                self.influx_endpoint and not (host and port.isdigit() and int(port) <= 65535)):
+            raise ValueError(f"influx_endpoint must be \"host:port\" or empty, got {self.influx_endpoint!r}")
+        if not isinstance(self.lan_port, int) or not 0 <= self.lan_port <= 65535:
+            raise ValueError(f"lan_port must be a TCP port (0 disables), got {self.lan_port!r}")
+
+
+def _coerce(values):
+    """
+    Turn JSON values into BMSConfig field types.
+    Unknown keys raise ValueError; I2C addresses may be given as "0x40".
+    """
+    known = {f.name: f for f in fields(BMSConfig)}
+    result = {}
+    for key, value in values.items():
+        if key not in known:
+            raise ValueError(f"Unknown config key: {key}")
+        try:
+            if key == "relay_pins":
+                value = tuple(int(pin) for pin in value)
+            elif key.endswith("_address") and isinstance(value, str):
+                value = int(value, 0)
+            elif known[key].type is float:
+                value = float(value)
+            elif known[key].type is int:
+                value = int(value)
+        except (TypeError, ValueError):
+            raise ValueError(f"Invalid value for {key}: {value!r}")
+        result[key] = value
+    return result
+
+
+#%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%  Config manager   %%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%
+
+class ConfigManager:
+    """
+    Holds the active BMSConfig and applies file / Firebase updates atomically.
+    - path: local JSON file (missing file means defaults)
+    - on_change: callables (old, new) run after every applied change
+    """
+    def __init__(self, path, defaults=None):
+        self.path = path
+        self.defaults = defaults or BMSConfig()
+        self.current = self.defaults  # Readers just take this reference
+        self.on_change = []
+        self.lock = threading.Lock()
+        self._file_values = {}
+        self._remote_values = {}
+        self._mtime = None
+
+    def load(self):
+        """
+        Initial load at start-up; invalid files raise ValueError so a broken
+        config is noticed before the hardware is touched.
+        """
+        self._file_values = self._read_file()
+        with self.lock:
+            self._commit(self._build(restart_ok=True), "file")
+        return self.current
+
+    def reload_if_changed(self):
+        """
+        Re-read the file if its modification time changed (one stat call).
+        Returns True if a new config was applied.
+        """
+        try:
+            mtime = os.stat(self.path).st_mtime
+        except FileNotFoundError:
+            mtime = None
+        if mtime == self._mtime:
+            return False
+        try:
+            file_values = self._read_file()
+        except ValueError as e:
+            log.warning("Ignoring invalid config file %s: %s", self.path, e)
+            self._mtime = mtime  # Do not retry until it changes again
+            return False
+        return self._apply(file_values=file_values, source="file")
+
+    def apply_remote(self, path, data):
+        """
+        Apply a change from the Firebase config node listener.
+        path/data are the event fields ("/" with the whole node, or "/key").
+        """
+        if path in ("/", ""):
+            remote = dict(data or {})
+        else:
+            remote = dict(self._remote_values)
+            key = path.strip("/")
+            if data is None:
+                remote.pop(key, None)
+            else:
+                remote[key] = data
+        return self._apply(remote_values=remote, source="firebase")
+
+    def _read_file(self):
+        try:
+            self._mtime = os.stat(self.path).st_mtime
+            with open(self.path) as f:
+                values = json.load(f)
+        except FileNotFoundError:
+            self._mtime = None
+            return {}
+        if not isinstance(values, dict):
+            raise ValueError(f"{self.path} must contain a JSON object")
+        return _coerce(values)
+
+    def _apply(self, file_values=None, remote_values=None, source=""):
+        with self.lock:
+            old_file, old_remote = self._file_values, self._remote_values
+            try:
+                if file_values is not None:
+                    self._file_values = file_values
+                if remote_values is not None:
+                    self._remote_values = _coerce(remote_values)
+                new = self._build(restart_ok=False)
+            except ValueError as e:
+                self._file_values, self._remote_values = old_file, old_remote
+                log.warning("Rejected %s config change: %s", source, e)
+                return False
+            return self._commit(new, source)
+
+    def _build(self, restart_ok):
+        new = replace(self.defaults, **{**self._file_values, **self._remote_values})
+        new.validate()
+        if not restart_ok:
+            # Keep hardware settings as they are until the next restart
+            pinned = {name: getattr(self.current, name) for name in BMSConfig.RESTART_ONLY
+                      if getattr(new, name) != getattr(self.current, name)}
+            if pinned:
+                log.warning("Config fields %s need a restart to take effect", sorted(pinned))
+                new = replace(new, **pinned)
+        return new
+
+    def _commit(self, new, source):
+        # Caller holds the lock
+        old = self.current
+        if new == old:
+            return False
+        self.current = new  # Atomic swap
+        log.info("Config updated from %s: %s", source,
+                 {k: v for k, v in asdict(new).items() if asdict(old)[k] != v})
+        for callback in self.on_change:
+            try:
+                callback(old, new)
+            except Exception as e:
+                log.warning("Config change callback failed: %s", e)
+        return True
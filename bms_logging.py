@@ -0,0 +1,161 @@
+# Non-blocking structured logging for the battery management system
+#
+# Callers only pay for a filter check and a put on an in-memory queue; a
+# background QueueListener thread formats records as JSON lines and writes
+# them to a size-rotated file whose old generations are gzip-compressed,
+# so the SD card neither slows the control loop nor fills up.
+# Each subsystem logger ("bms.sensors", "bms.relay", ...) is rate limited
+# on its own, so a failing sensor cannot flood the log.
+import os  # Remove rotated files once compressed
+import copy  # Queue a copy of each record, as QueueHandler does
+import gzip  # Compress rotated files
+import json  # JSON-lines output
+import queue  # Hand-off to the writer thread
+import shutil  # Stream a file into its gzip copy
+import logging
+import logging.handlers
+from time import monotonic
+from datetime import datetime, timezone
+
+# Attributes every LogRecord has; anything else came in through extra=
+_STANDARD_ATTRS = set(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {"message", "asctime"}
+
+
+#%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%  Formatting   %%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%
+
+class JsonLinesFormatter(logging.Formatter):
+    """
+    One JSON object per line: ts, level, logger, msg plus any extra= fields,
+    and the traceback as "exc" when there is one.
+    """
+    def format(self, record):
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in _STANDARD_ATTRS and not key.startswith("_"):
+                entry[key] = value
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry["exc"] = record.exc_text  # Formatted on the caller's thread (prepare)
+        return json.dumps(entry, default=str)
+
+
+#%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%  Rate limiting   %%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%
+
+class RateLimitFilter(logging.Filter):
+    """
+    Token bucket per subsystem (logger name up to the second dot, e.g.
+    "bms.sensors"). Dropped records are counted and the count is attached
+    to the next record that passes as "suppressed".
+    - rates: {subsystem: (records per second, burst)}; default used otherwise
+    - WARNING records are limited too (a failing sensor warns every
+      sample); ERROR and above always pass
+    """
+    def __init__(self, default=(5.0, 20), rates=None):
+        super().__init__()
+        self.default = default
+        self.rates = rates or {}
+        self.buckets = {}  # subsystem -> [tokens, last refill, suppressed]
+
+    def filter(self, record):
+        if record.levelno >= logging.ERROR:
+            return True
+        subsystem = ".".join(record.name.split(".")[:2])
+        rate, burst = self.rates.get(subsystem, self.default)
+        now = monotonic()
+        bucket = self.buckets.get(subsystem)
+        if bucket is None:
+            bucket = self.buckets[subsystem] = [burst, now, 0]
+        bucket[0] = min(burst, bucket[0] + (now - bucket[1]) * rate)
+        bucket[1] = now
+        if bucket[0] < 1.0:
+            bucket[2] += 1
+            return False
+        bucket[0] -= 1.0
+        if bucket[2]:
+            record.suppressed = bucket[2]
+            bucket[2] = 0
+        return True
+
+
+#%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%  Handlers   %%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """
+    QueueHandler that drops (and counts) records when the queue is full
+    instead of blocking or printing a traceback on the caller's thread.
+    """
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record):
+        # The stock prepare() folds the traceback into msg and drops exc_text;
+        # keep the message plain and the traceback text in its own field
+        record = copy.copy(record)
+        record.message = record.getMessage()
+        record.msg = record.message
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+        record.exc_info = None  # Traceback objects must not outlive the caller
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class CompressingRotatingFileHandler(logging.handlers.RotatingFileHandler):
+    """
+    Size-based rotation; rotated generations are stored as bms.log.1.gz, ...
+    Runs on the writer thread only, so compression never delays callers.
+    """
+    def __init__(self, filename, max_bytes, backup_count):
+        super().__init__(filename, maxBytes=max_bytes, backupCount=backup_count, delay=True)
+        self.namer = lambda name: name + ".gz"
+        self.rotator = self._compress
+
+    @staticmethod
+    def _compress(source, dest):
+        with open(source, "rb") as f_in, gzip.open(dest, "wb") as f_out:
+            shutil.copyfileobj(f_in, f_out)
+        os.remove(source)
+
+
+def setup_logging(path, level=logging.INFO, max_bytes=1024 * 1024, backup_count=5,
+                  queue_size=10000, rate_limits=None, console=True):
+    """
+    Route every "bms.*" logger (and the root logger) through one queue.
+    Returns the started QueueListener; call .stop() on exit to flush.
+    - rate_limits: {subsystem: (records per second, burst)}
+    - console: also echo plain-text lines to stdout from the writer thread
+    """
+    log_queue = queue.Queue(maxsize=queue_size)
+    queue_handler = DroppingQueueHandler(log_queue)
+    queue_handler.addFilter(RateLimitFilter(rates=rate_limits))
+
+    file_handler = CompressingRotatingFileHandler(path, max_bytes, backup_count)
+    file_handler.setFormatter(JsonLinesFormatter())
+    handlers = [file_handler]
+    if console:
+        stream_handler = logging.StreamHandler()
+        stream_handler.setFormatter(logging.Formatter("%(asctime)s %(name)s: %(message)s"))
+        handlers.append(stream_handler)
+
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(queue_handler)
+    root.setLevel(level)
+
+    listener = logging.handlers.QueueListener(log_queue, *handlers, respect_handler_level=True)
+    listener.start()
+    return listener
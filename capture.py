@@ -0,0 +1,151 @@
+# High-resolution INA226 capture, triggered from the dashboard
+#
+# Writing {"duration": N} to board1/capture/request makes the Pi sample
+# every INA226 channel as fast as the bus allows for N seconds, keep the
+# samples in a local buffer and upload them as one compressed node under
+# /UsersData/{uid}/captures/{start timestamp}. Progress is reported on
+# board1/capture/status. The regular 18 s uploads are not affected.
+import zlib  # Compress the capture blob
+import base64  # Firebase nodes hold text, not bytes
+import threading  # Capture runs beside main_loop
+import logging  # Report capture progress
+from array import array  # Compact float buffers
+from time import monotonic, time
+
+log = logging.getLogger("bms.capture")
+
+# INA226 channels in buffer order: bus voltage (V), shunt voltage (mV),
+# current (mA) and power (mW), as returned by the ina226 library
+CHANNELS = ("bus_voltage", "shunt_voltage", "current", "power")
+ENCODING = "f32-columns+zlib+base64"
+
+
+#%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%  Blob encoding   %%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%
+
+def encode_capture(offsets, columns):
+    """
+    Pack sample offsets (s since start) and channel columns as float32
+    arrays laid out one after another, then zlib + base64.
+    """
+    raw = array("f", offsets).tobytes()
+    for column in columns:
+        raw += array("f", column).tobytes()
+    return base64.b64encode(zlib.compress(raw, 9)).decode("ascii")
+
+
+def decode_capture(node):
+    """
+    Inverse of encode_capture for offline analysis.
+    Returns {"t": [...], "bus_voltage": [...], ...} from an uploaded node.
+    """
+    if node.get("encoding") != ENCODING:
+        raise ValueError(f"Unsupported capture encoding: {node.get('encoding')}")
+    values = array("f")
+    values.frombytes(zlib.decompress(base64.b64decode(node["data"])))
+    count = node["samples"]
+    names = ["t"] + list(node["channels"])
+    return {name: values[i * count:(i + 1) * count].tolist() for i, name in enumerate(names)}
+
+
+#%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%  Capture runner   %%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%
+
+class CaptureRecorder:
+    """
+    Runs one capture at a time on a background thread.
+    - read_channels: callable returning one value per entry of CHANNELS
+    - upload: callable (path, data) used for the blob and status nodes
+    - capture_path: where blobs are written, e.g. /UsersData/{uid}/captures
+    - status_path: node the dashboard watches for progress
+    - on_start / on_finish: optional hooks, e.g. switch the INA226 to its
+      fastest conversion time and back
+    """
+    def __init__(self, read_channels, upload, capture_path, status_path="board1/capture/status",
+                 max_duration=60, max_samples=200000, on_start=None, on_finish=None):
+        self.read_channels = read_channels
+        self.upload = upload
+        self.capture_path = capture_path
+        self.status_path = status_path
+        self.max_duration = max_duration
+        self.max_samples = max_samples
+        self.on_start = on_start
+        self.on_finish = on_finish
+        self.thread = None
+
+    @property
+    def running(self):
+        return self.thread is not None and self.thread.is_alive()
+
+    def handle_command(self, data):
+        """
+        Start a capture from a request node value like {"duration": 10}.
+        Returns True if a capture was started.
+        """
+        if not isinstance(data, dict):
+            return False
+        if self.running:
+            log.warning("Capture already running, request ignored")
+            return False
+        try:
+            duration = float(data.get("duration", 10))
+        except (TypeError, ValueError):
+            log.warning("Invalid capture request: %r", data)
+            return False
+        duration = max(0.1, min(duration, self.max_duration))
+        self.thread = threading.Thread(target=self._run, args=(duration,),
+                                       name="capture", daemon=True)
+        self.thread.start()
+        return True
+
+    def record(self, duration):
+        """
+        Sample all channels back to back for `duration` seconds.
+        Returns (offsets, columns, errors).
+        """
+        offsets = array("d")
+        columns = [array("d") for _ in CHANNELS]
+        errors = 0
+        start = monotonic()
+        now = start
+        while now - start < duration and len(offsets) < self.max_samples:
+            try:
+                values = self.read_channels()
+            except Exception:
+                errors += 1  # Skip the sample, keep the timing honest
+                now = monotonic()
+                continue
+            now = monotonic()
+            offsets.append(now - start)
+            for column, value in zip(columns, values):
+                column.append(value)
+        return offsets, columns, errors
+
+    def _run(self, duration):
+        started = int(time())
+        self.upload(self.status_path, {"state": "running", "started": started, "duration": duration})
+        try:
+            if self.on_start:
+                self.on_start()
+            try:
+                offsets, columns, errors = self.record(duration)
+            finally:
+                if self.on_finish:
+                    self.on_finish()
+            count = len(offsets)
+            node = {
+                "started": started,
+                "duration": duration,
+                "samples": count,
+                "rate_hz": round(count / offsets[-1], 1) if count > 1 and offsets[-1] else 0,
+                "read_errors": errors,
+                "channels": list(CHANNELS),
+                "encoding": ENCODING,
+                "data": encode_capture(offsets, columns),
+            }
+            path = f"{self.capture_path}/{started}"
+            self.upload(path, node)
+            self.upload(self.status_path, {"state": "done", "started": started,
+                                           "samples": count, "path": path})
+            log.info("Capture of %d samples uploaded to %s", count, path)
+        except Exception as e:
+            log.warning("Capture failed: %s", e)
+            self.upload(self.status_path, {"state": "error", "started": started, "error": str(e)})
@@ -0,0 +1,27 @@
+# Charger control policy shared by main_loop and the threshold simulator
+#
+# Kept free of hardware and Firebase imports so recorded or synthetic traces
+# can be replayed through exactly the logic that runs on the Pi.
+
+
+def charger_decision(bus_voltage, charger_on, low, high, time_to_low=None, lead_time=0.0):
+    """
+    Hysteresis control of the charger relay.
+    - bus_voltage: latest reading (None when the read failed)
+    - charger_on: current charger state, carried between calls
+    - time_to_low: forecast seconds until `low` is reached (None = unknown)
+    - lead_time: start the charger this many seconds before the forecast
+      crossing (0 disables the pre-emptive start)
+    Returns the new charger state: ON below `low` (or within lead_time of
+    it), OFF above `high`, unchanged in between or when there is no valid
+    reading.
+    """
+    if bus_voltage is None:
+        return charger_on
+    if bus_voltage < low:
+        return True
+    if bus_voltage > high:
+        return False
+    if time_to_low is not None and time_to_low < lead_time:
+        return True
+    return charger_on
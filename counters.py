@@ -0,0 +1,168 @@
+# Persistent energy and relay-wear counters
+#
+# Running totals kept incrementally from the 1 s samples, so reports never
+# re-scan raw history:
+#   - energy into / out of the pack (Wh) from bus voltage x signed current
+#   - charger duty cycle (seconds charger on / seconds observed)
+#   - actuation count per relay (wear)
+#   - uptime and boot count
+# Lifetime totals and the current day's totals are checkpointed to a small
+# JSON file with write-to-temp + fsync + rename, so a power cut loses at most
+# one checkpoint interval and never leaves a half-written file. When the
+# date changes the finished day is kept as a summary until it is uploaded.
+import os  # Atomic replace and fsync
+import json  # Checkpoint file
+import threading  # Relay callbacks arrive on the Firebase thread
+import logging  # Checkpoint problems
+from datetime import date
+
+log = logging.getLogger("bms.counters")
+
+
+def _empty_totals():
+    return {"energy_in_wh": 0.0, "energy_out_wh": 0.0, "charger_on_s": 0.0,
+            "observed_s": 0.0, "uptime_s": 0.0, "relay_actuations": {}}
+
+
+def _with_duty(totals):
+    summary = dict(totals, relay_actuations=dict(totals["relay_actuations"]))
+    observed = totals["observed_s"]
+    summary["charger_duty"] = round(totals["charger_on_s"] / observed, 4) if observed else None
+    return summary
+
+
+class EnergyCounters:
+    """
+    Running totals with crash-safe checkpoints.
+    - path: checkpoint file
+    - max_dt: samples further apart than this (s) are not integrated
+      (a missed read or a stall must not turn into hours of energy)
+    - current_sign: 1 when positive current means charging
+    """
+    def __init__(self, path, max_dt=5.0, current_sign=1):
+        self.path = path
+        self.max_dt = max_dt
+        self.current_sign = current_sign
+        self.lock = threading.Lock()
+        self.lifetime = _empty_totals()
+        self.lifetime["boots"] = 0
+        self.day = _empty_totals()
+        self.day_date = date.today().isoformat()
+        self.unsent = {}  # {YYYY-MM-DD: summary} finished days not yet uploaded
+        self.previous = None  # (t, power)
+        self.last_uptime = None
+
+    def load(self):
+        """
+        Restore totals from the checkpoint (if any) and count this boot.
+        """
+        try:
+            with open(self.path) as f:
+                state = json.load(f)
+            self.lifetime.update(state["lifetime"])
+            if state["day"].get("date"):
+                self.day_date = state["day"].pop("date")
+            self.day.update(state["day"])
+            self.unsent = state.get("unsent", {})
+        except FileNotFoundError:
+            log.info("No counter checkpoint at %s, starting from zero", self.path)
+        except (ValueError, KeyError, TypeError) as e:
+            # Keep the damaged file for inspection instead of overwriting it
+            os.replace(self.path, self.path + ".corrupt")
+            log.error("Counter checkpoint %s unreadable (%s), moved aside, starting from zero",
+                      self.path, e)
+        self.lifetime["boots"] += 1
+        return self
+
+    def _both(self):
+        return (self.lifetime, self.day)
+
+    def add_sample(self, voltage, current, t, charger_on):
+        """
+        Integrate one sample (V, A, monotonic seconds).
+        """
+        with self.lock:
+            if self.last_uptime is not None:
+                for totals in self._both():
+                    totals["uptime_s"] += t - self.last_uptime
+            self.last_uptime = t
+            if voltage is None or current is None:
+                self.previous = None
+                return
+            power = voltage * current * self.current_sign
+            previous, self.previous = self.previous, (t, power)
+            if previous is None or not 0 < t - previous[0] <= self.max_dt:
+                return
+            dt = t - previous[0]
+            energy_wh = (power + previous[1]) * 0.5 * dt / 3600.0  # Trapezoid
+            for totals in self._both():
+                if energy_wh >= 0:
+                    totals["energy_in_wh"] += energy_wh
+                else:
+                    totals["energy_out_wh"] -= energy_wh
+                totals["observed_s"] += dt
+                if charger_on:
+                    totals["charger_on_s"] += dt
+
+    def count_actuation(self, gpio):
+        with self.lock:
+            for totals in self._both():
+                counts = totals["relay_actuations"]
+                counts[str(gpio)] = counts.get(str(gpio), 0) + 1
+
+    def roll_day(self, today=None):
+        """
+        Close the current day when the date has changed; the finished day is
+        kept in unsent until mark_sent(). Returns True on rollover.
+        """
+        today = today or date.today().isoformat()
+        with self.lock:
+            if today == self.day_date:
+                return False
+            self.unsent[self.day_date] = _with_duty(self.day)
+            self.day = _empty_totals()
+            self.day_date = today
+        return True
+
+    def summary_unsent(self):
+        """
+        Finished days waiting for upload ({YYYY-MM-DD: summary}).
+        """
+        with self.lock:
+            return dict(self.unsent)
+
+    def mark_sent(self, day):
+        with self.lock:
+            self.unsent.pop(day, None)
+
+    def summary(self):
+        """
+        Lifetime and today's totals, with the duty cycle worked out.
+        """
+        with self.lock:
+            return {"lifetime": dict(_with_duty(self.lifetime), boots=self.lifetime["boots"]),
+                    "today": dict(_with_duty(self.day), date=self.day_date)}
+
+    def checkpoint(self):
+        """
+        Write the totals atomically: temp file, fsync, rename over the old one.
+        """
+        with self.lock:
+            state = {"lifetime": self.lifetime, "day": dict(self.day, date=self.day_date),
+                     "unsent": self.unsent}
+            text = json.dumps(state, indent=1)
+        tmp = self.path + ".tmp"
+        with open(tmp, "w") as f:
+            f.write(text)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.path)
+        try:
+            # Make the rename itself durable
+            fd = os.open(os.path.dirname(os.path.abspath(self.path)), os.O_RDONLY)
+            try:
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+        except OSError:
+            pass  # Not every filesystem allows fsync on a directory
@@ -0,0 +1,271 @@
+# Local stand-in for the Firebase Realtime Database REST API
+#
+# Keeps the JSON tree in memory and answers GET/PUT/PATCH/POST/DELETE on
+# "/<path>.json" the same way the real database does, so the async client,
+# uploads and benchmarks can run without a network or credentials.
+# GET also understands key-ordered queries (orderBy="$key" with startAt,
+# endAt, limitToFirst, limitToLast), which the exporter pages with.
+#
+# Run on its own:  python fake_rtdb.py --port 9000 [--demo-readings 100000]
+import json  # Request/response bodies
+import hashlib  # ETags
+import threading  # Serve in the background and guard the tree
+import argparse  # Command line options when run standalone
+from time import sleep, time  # Artificial latency and push IDs
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler  # Stdlib HTTP server
+from urllib.parse import urlsplit, parse_qs, unquote
+from firebase_client import key_order  # Same child order as the real database
+
+
+#%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%  In-memory JSON tree   %%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%
+
+class JsonTree:
+    """
+    Thread-safe nested-dict store with Realtime Database write semantics:
+    writing null deletes a node and empty parents disappear.
+    """
+    def __init__(self, data=None):
+        self.root = data or {}
+        self.lock = threading.Lock()
+        self._push_counter = 0
+
+    @staticmethod
+    def split(path):
+        return [part for part in path.strip("/").split("/") if part]
+
+    def get(self, path):
+        with self.lock:
+            return self._get(self.split(path))
+
+    def _get(self, keys):
+        node = self.root
+        for key in keys:
+            if not isinstance(node, dict) or key not in node:
+                return None
+            node = node[key]
+        return node
+
+    def set(self, path, value):
+        with self.lock:
+            self._set(self.split(path), value)
+
+    def update(self, path, values):
+        with self.lock:
+            base = self.split(path)
+            for key, value in values.items():
+                self._set(base + self.split(key), value)
+
+    def push(self, path, value):
+        with self.lock:
+            self._push_counter += 1
+            key = f"-{int(time() * 1000):013d}{self._push_counter:06d}"
+            self._set(self.split(path) + [key], value)
+            return key
+
+    def query(self, path, start_at=None, end_at=None, limit_first=None, limit_last=None):
+        """
+        Children of path ordered by key, filtered like orderBy="$key".
+        """
+        with self.lock:
+            node = self._get(self.split(path))
+            if not isinstance(node, dict):
+                return node
+            keys = sorted(node, key=key_order)
+            if start_at is not None:
+                keys = [key for key in keys if key_order(key) >= key_order(start_at)]
+            if end_at is not None:
+                keys = [key for key in keys if key_order(key) <= key_order(end_at)]
+            if limit_first is not None:
+                keys = keys[:limit_first]
+            if limit_last is not None:
+                keys = keys[-limit_last:] if limit_last else []
+            return {key: node[key] for key in keys}
+
+    def get_with_etag(self, path):
+        value = self.get(path)
+        return value, etag_of(value)
+
+    def set_if_match(self, path, value, etag):
+        # Compare-and-set under one lock, like the real if-match handling
+        with self.lock:
+            current = self._get(self.split(path))
+            if etag_of(current) != etag:
+                return False, current, etag_of(current)
+            self._set(self.split(path), value)
+            return True, value, etag_of(value)
+
+    def _set(self, keys, value):
+        if not keys:
+            self.root = value if isinstance(value, dict) else {}
+            return
+        parents = [self.root]
+        node = self.root
+        for key in keys[:-1]:
+            child = node.get(key)
+            if not isinstance(child, dict):
+                if value is None:
+                    return  # Deleting something that does not exist
+                child = node[key] = {}
+            node = child
+            parents.append(node)
+        if value is None:
+            node.pop(keys[-1], None)
+            # Prune parents that became empty
+            for depth in range(len(keys) - 1, 0, -1):
+                if not parents[depth]:
+                    parents[depth - 1].pop(keys[depth - 1], None)
+        else:
+            node[keys[-1]] = value
+
+
+def etag_of(value):
+    # Opaque to clients; any stable hash of the node content will do
+    return hashlib.sha1(json.dumps(value, sort_keys=True).encode()).hexdigest()
+
+
+#%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%  HTTP front end   %%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # Keep-alive and pipelining like the real service
+    disable_nagle_algorithm = True  # Headers and body go out as separate writes
+
+    def log_message(self, format, *args):
+        pass  # Stay quiet; benchmarks issue thousands of requests
+
+    def _parse(self):
+        url = urlsplit(self.path)
+        path = unquote(url.path)
+        if not path.endswith(".json"):
+            self._reply(400, {"error": "Paths must end in .json"})
+            return None, None, None
+        query = {key: values[-1] for key, values in parse_qs(url.query).items()}
+        length = int(self.headers.get("Content-Length", 0))
+        body = json.loads(self.rfile.read(length)) if length else None
+        if self.server.latency:
+            sleep(self.server.latency)
+        return path[:-len(".json")], query, body
+
+    def _reply(self, status, payload=None, silent=False, headers=None):
+        body = b"" if silent or status == 204 else json.dumps(payload).encode()
+        self.send_response(204 if silent and status < 300 else status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        path, query, _ = self._parse()
+        if path is None:
+            return
+        if "orderBy" in query:
+            try:
+                if json.loads(query["orderBy"]) != "$key":
+                    raise ValueError("only orderBy=\"$key\" is supported here")
+                bounds = {name: json.loads(query[name]) for name in ("startAt", "endAt") if name in query}
+                limits = {name: int(query[name]) for name in ("limitToFirst", "limitToLast") if name in query}
+            except ValueError as e:
+                self._reply(400, {"error": str(e)})
+                return
+            self._reply(200, self.server.tree.query(
+                path, bounds.get("startAt"), bounds.get("endAt"),
+                limits.get("limitToFirst"), limits.get("limitToLast")))
+        elif self.headers.get("X-Firebase-ETag") == "true":
+            value, etag = self.server.tree.get_with_etag(path)
+            self._reply(200, value, headers={"ETag": etag})
+        else:
+            self._reply(200, self.server.tree.get(path))
+
+    def do_PUT(self):
+        path, query, body = self._parse()
+        if path is None:
+            return
+        etag = self.headers.get("if-match")
+        if etag is not None:
+            written, value, etag = self.server.tree.set_if_match(path, body, etag)
+            self._reply(200 if written else 412, value, headers={"ETag": etag})
+        else:
+            self.server.tree.set(path, body)
+            self._reply(200, body, silent=query.get("print") == "silent")
+
+    def do_PATCH(self):
+        path, query, body = self._parse()
+        if path is None:
+            return
+        if not isinstance(body, dict):
+            self._reply(400, {"error": "PATCH body must be an object"})
+            return
+        self.server.tree.update(path, body)
+        self._reply(200, body, silent=query.get("print") == "silent")
+
+    def do_POST(self):
+        path, query, body = self._parse()
+        if path is not None:
+            self._reply(200, {"name": self.server.tree.push(path, body)})
+
+    def do_DELETE(self):
+        path, query, _ = self._parse()
+        if path is not None:
+            self.server.tree.set(path, None)
+            self._reply(200, None, silent=query.get("print") == "silent")
+
+
+class _Server(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 128  # Pooled clients open many sockets at once
+
+
+class FakeRealtimeDatabase:
+    """
+    Background fake database server.
+    - port: 0 picks a free port; read the final URL from .url
+    - latency: seconds added to every request to mimic a network round trip
+    Usable as a context manager.
+    """
+    def __init__(self, host="127.0.0.1", port=0, latency=0.0, data=None):
+        self.server = _Server((host, port), _Handler)
+        self.server.tree = JsonTree(data)
+        self.server.latency = latency
+        self.tree = self.server.tree
+        self.url = f"http://{host}:{self.server.server_address[1]}"
+        self.thread = None
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever,
+                                       name="fake-rtdb", daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Local fake Firebase Realtime Database")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9000)
+    parser.add_argument("--latency", type=float, default=0.0, help="Added delay per request (s)")
+    parser.add_argument("--demo-readings", type=int, default=0, metavar="N",
+                        help="Seed /UsersData/demo/readings with N readings 18 s apart")
+    args = parser.parse_args()
+
+    fake = FakeRealtimeDatabase(args.host, args.port, args.latency)
+    if args.demo_readings:
+        start = int(time()) - args.demo_readings * 18
+        fake.tree.set("/UsersData/demo/readings", {
+            str(start + k * 18): {"timestamp": start + k * 18, "voltage": round(13.2 + (k % 50) / 100, 2),
+                                  "temperature": 20.5, "humidity": 45.0}
+            for k in range(args.demo_readings)})
+    print(f"Fake Realtime Database listening on {fake.url}")
+    try:
+        fake.server.serve_forever()
+    except KeyboardInterrupt:
+        print("Exiting by user...")
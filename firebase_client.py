@@ -0,0 +1,382 @@
+# Asyncio client for the Firebase Realtime Database REST API
+#
+# Replaces the blocking firebase_admin.db calls used for uploads with a
+# keep-alive connection pool running on its own event loop thread.
+# Only the standard library is used so it runs on the Pi's stock Python.
+import asyncio  # Event loop, streams and semaphores
+import json  # Encode/decode request and response bodies
+import ssl  # TLS for https:// database URLs
+import threading  # Background thread that owns the event loop
+import logging  # Report failed fire-and-forget writes
+from time import time  # Token expiry bookkeeping
+from datetime import timezone  # Token expiry is naive UTC
+from urllib.parse import urlsplit, urlencode, quote  # Build request targets
+
+log = logging.getLogger("bms.firebase")
+
+
+#%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%  Errors   %%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%
+
+class FirebaseError(Exception):
+    """
+    Raised when the database answers with a non-2xx status.
+    - status: HTTP status code
+    - body: decoded JSON body (or raw text) returned by the server
+    """
+    def __init__(self, status, body):
+        super().__init__(f"Firebase request failed with HTTP {status}: {body}")
+        self.status = status
+        self.body = body
+
+
+#%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%  Connection handling   %%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%
+
+class _Connection:
+    """
+    A single HTTP/1.1 keep-alive connection to the database host.
+    Requests can be written back to back (pipelined) and the responses are
+    read in the same order.
+    """
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+        self.reusable = True  # Cleared when the server asks to close
+
+    def send(self, method, target, host, headers, body):
+        lines = [f"{method} {target} HTTP/1.1", f"Host: {host}",
+                 "Connection: keep-alive", f"Content-Length: {len(body)}"]
+        lines += [f"{name}: {value}" for name, value in headers.items()]
+        self.writer.write(("\r\n".join(lines) + "\r\n\r\n").encode("latin-1") + body)
+
+    async def read_response(self):
+        status_line = await self.reader.readline()
+        if not status_line:
+            raise ConnectionError("Connection closed by server")
+        status = int(status_line.split()[1])
+
+        headers = {}
+        while True:
+            line = await self.reader.readline()
+            if line in (b"\r\n", b"\n", b""):
+                break
+            name, _, value = line.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip()
+
+        if headers.get("transfer-encoding", "").lower() == "chunked":
+            body = bytearray()
+            while True:
+                size = int((await self.reader.readline()).split(b";")[0], 16)
+                if size == 0:
+                    await self.reader.readline()  # Trailing CRLF
+                    break
+                body += await self.reader.readexactly(size)
+                await self.reader.readline()  # CRLF after each chunk
+            body = bytes(body)
+        else:
+            body = await self.reader.readexactly(int(headers.get("content-length", 0)))
+
+        if headers.get("connection", "").lower() == "close":
+            self.reusable = False
+        return status, headers, body
+
+    def close(self):
+        self.reusable = False
+        self.writer.close()
+
+
+#%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%  Async client   %%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%
+
+class AsyncFirebaseClient:
+    """
+    Realtime Database REST client with a pooled keep-alive session.
+    - database_url: e.g. DATABASE_URL, or the URL of a local fake_rtdb server
+    - token_provider: optional callable returning an OAuth2 access token
+    - max_connections: upper bound on concurrent requests / open sockets
+    - timeout: per-request timeout in seconds
+    - pipeline_depth: requests written back to back on one connection by pipeline()
+    """
+    def __init__(self, database_url, token_provider=None, max_connections=4,
+                 timeout=10.0, pipeline_depth=8):
+        url = urlsplit(database_url)
+        self.host = url.hostname
+        self.port = url.port or (443 if url.scheme == "https" else 80)
+        self.ssl = ssl.create_default_context() if url.scheme == "https" else None
+        self.host_header = url.netloc
+        self.base_path = url.path.rstrip("/")
+        self.token_provider = token_provider
+        self.timeout = timeout
+        self.pipeline_depth = pipeline_depth
+        self.max_connections = max_connections
+        self._slots = None  # Created lazily inside the running loop
+        self._idle = []  # Idle keep-alive connections, most recent last
+
+    # ---- Pool management ----
+    async def _acquire(self):
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.max_connections)
+        await self._slots.acquire()
+        while self._idle:
+            conn = self._idle.pop()
+            if not conn.reader.at_eof():
+                return conn
+            conn.close()  # Server dropped it while idle
+        try:
+            reader, writer = await asyncio.wait_for(
+                asyncio.open_connection(self.host, self.port, ssl=self.ssl,
+                                        server_hostname=self.host if self.ssl else None),
+                self.timeout)
+        except BaseException:
+            self._slots.release()
+            raise
+        return _Connection(reader, writer)
+
+    def _release(self, conn):
+        if conn.reusable:
+            self._idle.append(conn)
+        else:
+            conn.close()
+        self._slots.release()
+
+    async def close(self):
+        while self._idle:
+            self._idle.pop().close()
+
+    # ---- Request building ----
+    async def _target(self, path, query):
+        params = dict(query or {})
+        if self.token_provider is not None:
+            token = self.token_provider()
+            if asyncio.iscoroutine(token):
+                token = await token
+            params["access_token"] = token
+        target = f"{self.base_path}/{quote(path.strip('/'))}.json"
+        if params:
+            target += "?" + urlencode(params)
+        return target
+
+    def _encode(self, data):
+        if data is None:
+            return b"", {}
+        return json.dumps(data, separators=(",", ":")).encode(), {"Content-Type": "application/json"}
+
+    @staticmethod
+    def _decode(status, headers, body):
+        try:
+            payload = json.loads(body) if body else None
+        except ValueError:
+            payload = body.decode(errors="replace")
+        if status >= 300:
+            raise FirebaseError(status, payload)
+        return payload
+
+    # ---- Request execution ----
+    async def request(self, method, path, data=None, query=None, headers=None, raw=False):
+        """
+        Send one request and return the decoded JSON body.
+        With raw=True, (status, headers, payload) is returned instead and
+        non-2xx statuses are not raised (used for conditional writes).
+        """
+        target = await self._target(path, query)
+        body, extra = self._encode(data)
+        extra.update(headers or {})
+        conn = await self._acquire()
+        try:
+            conn.send(method, target, self.host_header, extra, body)
+            status, resp_headers, resp_body = await asyncio.wait_for(
+                self._drain_and_read(conn), self.timeout)
+        except BaseException:
+            conn.close()  # State of the stream is unknown, never reuse it
+            self._release(conn)
+            raise
+        self._release(conn)
+        if raw:
+            try:
+                payload = json.loads(resp_body) if resp_body else None
+            except ValueError:
+                payload = resp_body.decode(errors="replace")
+            return status, resp_headers, payload
+        return self._decode(status, resp_headers, resp_body)
+
+    @staticmethod
+    async def _drain_and_read(conn):
+        await conn.writer.drain()
+        return await conn.read_response()
+
+    async def pipeline(self, calls):
+        """
+        Run many (method, path, data) calls, writing up to pipeline_depth
+        requests back to back on each pooled connection.
+        Results are returned in call order; failed calls return the exception.
+        """
+        groups = [calls[i:i + self.pipeline_depth]
+                  for i in range(0, len(calls), self.pipeline_depth)]
+        results = await asyncio.gather(*(self._pipeline_group(g) for g in groups))
+        return [item for group in results for item in group]
+
+    async def _pipeline_group(self, calls):
+        conn = await self._acquire()
+        try:
+            for method, path, data in calls:
+                body, extra = self._encode(data)
+                conn.send(method, await self._target(path, _silent(method)),
+                          self.host_header, extra, body)
+            await conn.writer.drain()
+            results = []
+            deadline = self.timeout * len(calls)
+            responses = await asyncio.wait_for(
+                _read_n(conn, len(calls)), deadline)
+            for status, headers, body in responses:
+                try:
+                    results.append(self._decode(status, headers, body))
+                except FirebaseError as e:
+                    results.append(e)
+        except BaseException:
+            conn.close()
+            self._release(conn)
+            raise
+        self._release(conn)
+        return results
+
+    # ---- Database operations (same names as firebase_admin.db.Reference) ----
+    async def get(self, path, **query):
+        return await self.request("GET", path, query=query)
+
+    async def set(self, path, data):
+        return await self.request("PUT", path, data, query=_silent("PUT"))
+
+    async def update(self, path, data):
+        return await self.request("PATCH", path, data, query=_silent("PATCH"))
+
+    async def push(self, path, data):
+        return await self.request("POST", path, data)
+
+    async def delete(self, path):
+        return await self.request("DELETE", path, query=_silent("DELETE"))
+
+    # ---- Conditional requests (ETag / if-match) ----
+    async def get_with_etag(self, path):
+        """
+        Read a node together with its ETag.
+        Returns (value, etag).
+        """
+        status, headers, payload = await self.request(
+            "GET", path, headers={"X-Firebase-ETag": "true"}, raw=True)
+        if status >= 300:
+            raise FirebaseError(status, payload)
+        return payload, headers.get("etag")
+
+    async def set_if_match(self, path, data, etag):
+        """
+        Write a node only if its ETag still matches.
+        Returns (written, current_value, current_etag); on a mismatch the
+        server's value and ETag are returned so the caller can reconcile.
+        """
+        status, headers, payload = await self.request(
+            "PUT", path, data, headers={"if-match": etag}, raw=True)
+        if status == 412:
+            return False, payload, headers.get("etag")
+        if status >= 300:
+            raise FirebaseError(status, payload)
+        return True, payload, headers.get("etag")
+
+
+def _silent(method):
+    # Writes ask for an empty 204 reply instead of echoing the data back
+    return {"print": "silent"} if method in ("PUT", "PATCH", "DELETE") else None
+
+
+async def _read_n(conn, count):
+    return [await conn.read_response() for _ in range(count)]
+
+
+def key_order(key):
+    """
+    Sort key matching the database's orderBy="$key": keys that are 32-bit
+    integers come first, numerically, then every other key as a string.
+    """
+    try:
+        number = int(key)
+        if -2 ** 31 <= number < 2 ** 31 and str(number) == key:
+            return (0, number, "")
+    except ValueError:
+        pass
+    return (1, 0, key)
+
+
+#%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%  Credentials   %%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%
+
+def admin_token_provider(cred, margin=60):
+    """
+    Wrap a firebase_admin credentials.Certificate as a token provider.
+    The access token is cached until shortly before it expires and refreshed
+    in a worker thread so the event loop is never blocked; concurrent
+    requests wait for one refresh instead of each starting their own.
+    """
+    cache = {"token": None, "expires": 0.0, "lock": None}
+
+    def stale():
+        return cache["token"] is None or time() > cache["expires"] - margin
+
+    async def provider():
+        if stale():
+            if cache["lock"] is None:
+                cache["lock"] = asyncio.Lock()  # Created on the client's own loop
+            async with cache["lock"]:
+                if stale():  # Not already refreshed by a request that held the lock
+                    info = await asyncio.get_running_loop().run_in_executor(None, cred.get_access_token)
+                    cache["token"] = info.access_token
+                    # google-auth reports expiry as a naive UTC datetime
+                    cache["expires"] = (info.expiry.replace(tzinfo=timezone.utc).timestamp()
+                                        if info.expiry else time() + 3600)
+        return cache["token"]
+
+    return provider
+
+
+#%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%  Bridge for synchronous callers   %%%%%%%%%%%%%%%%%%%%%%%%%%
+
+class FirebaseBridge:
+    """
+    Runs an AsyncFirebaseClient on a daemon thread so the synchronous main
+    loop can queue writes without waiting on the network.
+    Every method returns a concurrent.futures.Future; errors are logged.
+    """
+    def __init__(self, database_url, **client_options):
+        self.client = AsyncFirebaseClient(database_url, **client_options)
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever,
+                                       name="firebase-client", daemon=True)
+        self.thread.start()
+
+    def submit(self, coro):
+        future = asyncio.run_coroutine_threadsafe(coro, self.loop)
+        future.add_done_callback(_log_failure)
+        return future
+
+    def get(self, path, **query):
+        return self.submit(self.client.get(path, **query))
+
+    def set(self, path, data):
+        return self.submit(self.client.set(path, data))
+
+    def update(self, path, data):
+        return self.submit(self.client.update(path, data))
+
+    def push(self, path, data):
+        return self.submit(self.client.push(path, data))
+
+    def delete(self, path):
+        return self.submit(self.client.delete(path))
+
+    def pipeline(self, calls):
+        return self.submit(self.client.pipeline(calls))
+
+    def close(self, timeout=5):
+        asyncio.run_coroutine_threadsafe(self.client.close(), self.loop).result(timeout)
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join(timeout)
+
+
+def _log_failure(future):
+    if not future.cancelled() and future.exception() is not None:
+        log.warning("Firebase request failed: %r", future.exception())
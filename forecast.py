@@ -0,0 +1,137 @@
+# Time-to-empty / time-to-full forecasting from the recent voltage trend
+#
+# A straight line is fitted to the last `window` seconds of (t, voltage)
+# samples by least squares. The fit only needs five running sums (n, St,
+# Sv, Stt, Stv, plus Svv for the error), so each sample costs one add and
+# one subtract, O(1) however long the window. Times are kept relative to
+# the window start, and the sums are rebuilt from the window every
+# `window` samples, so float round-off cannot build up while the Pi runs
+# for months.
+# The line is extrapolated to a threshold only when the slope is
+# significant (|slope| > z * its standard error and above min_slope), so
+# flat LiFePO4 plateaus and sensor noise give "no forecast" instead of
+# wild numbers. A perfectly flat (quantised) plateau has a zero standard
+# error and a round-off slope of ~1e-15 V/s, which min_slope rejects;
+# forecasts beyond max_horizon are dropped as well.
+# After the charger switches off the voltage relaxes from the charge
+# voltage towards the resting plateau for many minutes; a line through
+# that fall predicts the low threshold far too early, so reset() can
+# ignore the first `hold_off` seconds (SETTLE_S after a charge).
+import math  # Standard error of the slope
+from collections import deque  # Sample window
+
+SETTLE_S = 1800.0  # Voltage relaxation after the charger switches off (s)
+
+
+class TrendForecaster:
+    """
+    Rolling least-squares voltage trend.
+    - window: seconds of history in the fit
+    - min_samples: samples needed before forecasting
+    - z: slope must exceed z standard errors to be trusted
+    - min_slope: smallest trend (V/s) worth forecasting
+    - max_horizon: longest forecast reported (s)
+    """
+    def __init__(self, window=1800.0, min_samples=120, z=3.0, min_slope=1e-6,
+                 max_horizon=7 * 86400.0):
+        self.window = window
+        self.min_samples = min_samples
+        self.z = z
+        self.min_slope = min_slope
+        self.max_horizon = max_horizon
+        self.hold_off = 0.0
+        self.ignore_until = -math.inf  # Samples before this time are skipped
+        self.reset_pending = False
+        self._clear()
+
+    def reset(self, hold_off=0.0):
+        """
+        Forget the history, e.g. after the charger switched and the voltage
+        jumped to a different curve, and skip the next hold_off seconds of
+        samples while the voltage settles. Safe from any thread: the history
+        is cleared by the next update() on the sampling thread, and fit()
+        reports nothing until then.
+        """
+        self.hold_off = hold_off
+        self.reset_pending = True
+
+    def _clear(self):
+        self.samples = deque()
+        self.t0 = None  # Time origin of the sums
+        self.n = 0
+        self.st = self.sv = self.stt = self.stv = self.svv = 0.0
+        self.since_rebase = 0
+
+    def _add(self, t, v, sign):
+        t -= self.t0
+        self.n += sign
+        self.st += sign * t
+        self.sv += sign * v
+        self.stt += sign * t * t
+        self.stv += sign * t * v
+        self.svv += sign * v * v
+
+    def _rebase(self):
+        # Recompute the sums from the window with the oldest sample as origin
+        self.t0 = self.samples[0][0]
+        self.n = 0
+        self.st = self.sv = self.stt = self.stv = self.svv = 0.0
+        for t, v in self.samples:
+            self._add(t, v, 1)
+        self.since_rebase = 0
+
+    def update(self, t, voltage):
+        """
+        Add one sample (monotonic seconds, volts); None readings are skipped.
+        """
+        if voltage is None:
+            return
+        if self.reset_pending:
+            self.reset_pending = False
+            self._clear()
+            self.ignore_until = t + self.hold_off
+        if t < self.ignore_until:
+            return
+        if self.t0 is None:
+            self.t0 = t
+        self.samples.append((t, voltage))
+        self._add(t, voltage, 1)
+        while t - self.samples[0][0] > self.window:
+            old_t, old_v = self.samples.popleft()
+            self._add(old_t, old_v, -1)
+        self.since_rebase += 1
+        if self.since_rebase >= len(self.samples):
+            self._rebase()  # Amortised O(1)
+
+    def fit(self):
+        """
+        (slope V/s, standard error of the slope, fitted voltage now) or None.
+        """
+        n = self.n
+        if self.reset_pending or n < max(self.min_samples, 3):
+            return None
+        sxx = self.stt - self.st * self.st / n
+        if sxx <= 0:
+            return None
+        sxy = self.stv - self.st * self.sv / n
+        syy = self.svv - self.sv * self.sv / n
+        slope = sxy / sxx
+        residual = max(syy - slope * sxy, 0.0) / (n - 2)
+        stderr = math.sqrt(residual / sxx)
+        t_now = self.samples[-1][0] - self.t0
+        level = self.sv / n + slope * (t_now - self.st / n)
+        return slope, stderr, level
+
+    def time_to(self, target):
+        """
+        Seconds until the trend reaches target voltage, or None when the
+        trend is not significant or is heading away from it.
+        """
+        fit = self.fit()
+        if fit is None:
+            return None
+        slope, stderr, level = fit
+        if abs(slope) < self.min_slope or abs(slope) <= self.z * stderr:
+            return None
+        seconds = (target - level) / slope
+        return seconds if 0 <= seconds <= self.max_horizon else None
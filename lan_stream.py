@@ -0,0 +1,175 @@
+# LAN telemetry streaming for technicians next to the rack
+#
+# An asyncio HTTP server on its own thread:
+#   GET /          tiny live page (EventSource)
+#   GET /stream    Server-Sent Events, one event per sample
+#   GET /snapshot  JSON history from the in-memory buffer (?last=N or ?since=unix_ts)
+# The sampler calls TelemetryHub.publish() which only appends to a deque and
+# schedules one callback on the server loop, so any number of clients costs
+# the sampler nothing. Each client has a small queue; a slow client that
+# falls behind is collapsed to the latest value instead of buffering.
+import json  # Event and snapshot payloads
+import asyncio  # Server loop
+import threading  # Server runs beside the scheduler
+import logging  # Client connect / error reports
+from collections import deque  # History and per-client queues
+from urllib.parse import urlsplit, parse_qs
+
+log = logging.getLogger("bms.lan")
+
+_PAGE = b"""<!DOCTYPE html><html><head><meta charset="utf-8"><title>BMS live</title></head>
+<body style="font-family:sans-serif"><h3>Battery monitor (LAN)</h3><pre id="s">waiting...</pre>
+<script>new EventSource('/stream').onmessage=e=>{document.getElementById('s').textContent=
+JSON.stringify(JSON.parse(e.data),null,2)};</script></body></html>"""
+
+
+class _Client:
+    def __init__(self, depth):
+        self.pending = deque()
+        self.depth = depth
+        self.ready = asyncio.Event()
+        self.dropped = 0
+
+    def offer(self, payload):
+        if len(self.pending) >= self.depth:
+            # Too slow: forget the backlog, keep only the newest value
+            self.dropped += len(self.pending)
+            self.pending.clear()
+        self.pending.append(payload)
+        self.ready.set()
+
+
+class TelemetryHub:
+    """
+    Sample fan-out point shared by the sampler and the LAN server.
+    - history: samples kept for /snapshot
+    - client_depth: queued events per client before collapsing to latest
+    """
+    def __init__(self, history=3600, client_depth=8):
+        self.history = deque(maxlen=history)
+        self.client_depth = client_depth
+        self.clients = set()
+        self.loop = None  # Set by the server once it runs
+
+    def publish(self, sample):
+        """
+        Called from the sampler thread; O(1) and never blocks.
+        """
+        payload = json.dumps(sample, separators=(",", ":"))
+        self.history.append((sample.get("timestamp"), payload))
+        if self.clients and self.loop is not None:
+            self.loop.call_soon_threadsafe(self._fan_out, payload)
+
+    def _fan_out(self, payload):
+        for client in self.clients:
+            client.offer(payload)
+
+    def snapshot(self, last=None, since=None):
+        items = list(self.history)
+        if since is not None:
+            items = [item for item in items if item[0] is not None and item[0] >= since]
+        if last is not None:
+            items = items[-last:] if last > 0 else []
+        return "[" + ",".join(payload for _, payload in items) + "]"
+
+
+class LanTelemetryServer:
+    """
+    Serves a TelemetryHub on the LAN from a daemon thread.
+    - write_timeout: seconds a client may block a write before it is dropped
+    """
+    def __init__(self, hub, host="0.0.0.0", port=8080, write_timeout=10.0):
+        self.hub = hub
+        self.host = host
+        self.port = port
+        self.write_timeout = write_timeout
+        self.loop = asyncio.new_event_loop()
+        self.server = None
+        self.thread = None
+        self.error = None
+
+    def start(self):
+        """
+        Start serving; raises OSError here if the port cannot be bound.
+        """
+        ready = threading.Event()
+        self.thread = threading.Thread(target=self._serve, args=(ready,), name="lan-stream", daemon=True)
+        self.thread.start()
+        ready.wait(5)
+        if self.error is not None:
+            raise self.error
+        return self
+
+    def stop(self):
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join(5)
+
+    def _serve(self, ready):
+        asyncio.set_event_loop(self.loop)
+        try:
+            self.server = self.loop.run_until_complete(
+                asyncio.start_server(self._handle, self.host, self.port))
+        except OSError as e:
+            self.error = e
+            ready.set()
+            return
+        self.port = self.server.sockets[0].getsockname()[1]  # Real port when 0 was given
+        self.hub.loop = self.loop
+        log.info("LAN telemetry on http://%s:%d/", self.host, self.port)
+        ready.set()
+        self.loop.run_forever()
+
+    async def _handle(self, reader, writer):
+        try:
+            request = await asyncio.wait_for(reader.readline(), 10)
+            while (await asyncio.wait_for(reader.readline(), 10)) not in (b"\r\n", b"\n", b""):
+                pass  # Headers are not needed
+            parts = request.decode("latin-1").split()
+            if len(parts) < 2 or parts[0] != "GET":
+                await self._reply(writer, 405, "text/plain", b"GET only\n")
+                return
+            url = urlsplit(parts[1])
+            if url.path == "/stream":
+                await self._stream(writer)
+            elif url.path == "/snapshot":
+                query = parse_qs(url.query)
+                last = int(query["last"][0]) if "last" in query else None
+                since = float(query["since"][0]) if "since" in query else None
+                body = self.hub.snapshot(last, since).encode()
+                await self._reply(writer, 200, "application/json", body)
+            elif url.path == "/":
+                await self._reply(writer, 200, "text/html", _PAGE)
+            else:
+                await self._reply(writer, 404, "text/plain", b"Not found\n")
+        except (asyncio.TimeoutError, ConnectionError, ValueError) as e:
+            log.debug("LAN client error: %s", e)
+        finally:
+            writer.close()
+
+    async def _reply(self, writer, status, content_type, body):
+        reason = {200: "OK", 404: "Not Found", 405: "Method Not Allowed"}[status]
+        writer.write(f"HTTP/1.1 {status} {reason}\r\nContent-Type: {content_type}\r\n"
+                     f"Content-Length: {len(body)}\r\nAccess-Control-Allow-Origin: *\r\n"
+                     f"Connection: close\r\n\r\n".encode() + body)
+        await asyncio.wait_for(writer.drain(), self.write_timeout)
+
+    async def _stream(self, writer):
+        writer.write(b"HTTP/1.1 200 OK\r\nContent-Type: text/event-stream\r\n"
+                     b"Cache-Control: no-cache\r\nAccess-Control-Allow-Origin: *\r\n\r\n")
+        client = _Client(self.hub.client_depth)
+        if self.hub.history:
+            client.offer(self.hub.history[-1][1])  # Show the current value straight away
+        self.hub.clients.add(client)
+        log.info("LAN stream client connected (%d total)", len(self.hub.clients))
+        try:
+            while True:
+                await client.ready.wait()
+                client.ready.clear()
+                if writer.is_closing():
+                    break  # Client went away; do not write into a dead socket
+                while client.pending:
+                    writer.write(b"data: " + client.pending.popleft().encode() + b"\n\n")
+                await asyncio.wait_for(writer.drain(), self.write_timeout)
+        finally:
+            self.hub.clients.discard(client)
+            log.info("LAN stream client left (%d dropped events)", client.dropped)
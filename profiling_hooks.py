@@ -0,0 +1,184 @@
+# On-demand sampling profiler for the running service
+#
+# Nothing is hooked into the program while idle: no sys.setprofile, no
+# timers, just a signal handler, a thread blocked on its wakeup pipe and
+# a control socket blocked in accept().
+# When triggered, a background thread samples the stack of every thread
+# (main_loop, Firebase listeners, uploader, ...) with sys._current_frames()
+# for N seconds and writes the counts as folded stacks, one line per
+# unique stack, which flamegraph.pl and speedscope read directly:
+#   MainThread;main_loop (Battery_managment_system_V14.py:512);run (scheduler.py:129) 37
+#
+# Trigger it without stopping charging control:
+#   kill -USR1 <pid>                              # default duration
+#   python profiling_hooks.py profile 60          # via the control socket
+#   python profiling_hooks.py status
+# Then:  flamegraph.pl /home/pi/profiles/bms-20240101-120000.folded > flame.svg
+import os  # Output directory, socket file
+import sys  # _current_frames
+import signal  # SIGUSR1 trigger
+import socket  # Unix control socket
+import argparse  # Client command line
+import threading  # Sampler and control threads
+import logging  # Profile start / finish reports
+from collections import Counter  # Stack counts
+from datetime import datetime  # Output file names
+from time import monotonic, sleep
+
+log = logging.getLogger("bms.profile")
+
+CONTROL_SOCKET = "/tmp/bms-control.sock"
+
+
+class StackSampler:
+    """
+    Samples all threads every interval seconds while a profile is running.
+    - out_dir: where .folded files are written
+    - max_duration: upper bound for one profile (s)
+    """
+    def __init__(self, out_dir, interval=0.01, max_duration=600):
+        self.out_dir = out_dir
+        self.interval = interval
+        self.max_duration = max_duration
+        self.lock = threading.Lock()
+        self.thread = None
+        self.last_path = None
+
+    @property
+    def running(self):
+        return self.thread is not None and self.thread.is_alive()
+
+    def start(self, duration=30):
+        """
+        Begin a profile of `duration` seconds in the background.
+        Returns the output path, or None if one is already running.
+        """
+        duration = max(0.1, min(float(duration), self.max_duration))
+        with self.lock:
+            if self.running:
+                return None
+            os.makedirs(self.out_dir, exist_ok=True)
+            path = os.path.join(self.out_dir, datetime.now().strftime("bms-%Y%m%d-%H%M%S.folded"))
+            self.thread = threading.Thread(target=self._run, args=(duration, path),
+                                           name="profiler", daemon=True)
+            self.thread.start()
+        log.info("Profiling all threads for %.0f s into %s", duration, path)
+        return path
+
+    def _run(self, duration, path):
+        counts = Counter()
+        labels = {}  # Code object -> frame label, so each function is formatted once
+        own = threading.get_ident()
+        samples = 0
+        deadline = monotonic() + duration
+        next_sample = monotonic()
+        while monotonic() < deadline:
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == own:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    label = labels.get(code)
+                    if label is None:
+                        label = labels[code] = (f"{code.co_name} ({os.path.basename(code.co_filename)}"
+                                                f":{code.co_firstlineno})").replace(";", ":")
+                    stack.append(label)
+                    frame = frame.f_back
+                stack.append(names.get(ident, f"thread-{ident}").replace(";", ":"))
+                counts[";".join(reversed(stack))] += 1
+            del frame
+            samples += 1
+            next_sample += self.interval
+            delay = next_sample - monotonic()
+            if delay > 0:
+                sleep(delay)
+            else:
+                next_sample = monotonic()  # Fell behind; do not burst to catch up
+
+        with open(path, "w") as f:
+            for stack, count in counts.most_common():
+                f.write(f"{stack} {count}\n")
+        self.last_path = path
+        log.info("Profile written: %s (%d samples, %d unique stacks)", path, samples, len(counts))
+
+
+def install_signal_handler(sampler, signum=signal.SIGUSR1, duration=30):
+    """
+    Start a profile when the process receives signum (main thread only).
+    The handler runs on the main thread in the middle of whatever it
+    interrupted, possibly while that holds the logging queue or threading
+    locks, so it only writes a byte to a pipe; a separate thread starts
+    the profile.
+    """
+    read_fd, write_fd = os.pipe()
+    os.set_blocking(write_fd, False)
+
+    def handler(received, frame):
+        try:
+            os.write(write_fd, b"\0")
+        except BlockingIOError:
+            pass  # A trigger is already waiting
+
+    def wait_for_trigger():
+        while True:
+            os.read(read_fd, 64)
+            sampler.start(duration)
+
+    threading.Thread(target=wait_for_trigger, name="profile-trigger", daemon=True).start()
+    signal.signal(signum, handler)
+
+
+class ControlSocket:
+    """
+    Unix socket accepting one-line commands:
+      "profile [seconds]" -> path of the profile being written
+      "status"            -> running / idle and the last profile path
+    """
+    def __init__(self, sampler, path=CONTROL_SOCKET):
+        self.sampler = sampler
+        self.path = path
+        self.sock = None
+
+    def start(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)  # Left behind by a previous run
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.bind(self.path)
+        os.chmod(self.path, 0o600)
+        self.sock.listen(2)
+        threading.Thread(target=self._serve, name="control-socket", daemon=True).start()
+        return self
+
+    def _serve(self):
+        while True:
+            conn, _ = self.sock.accept()
+            with conn:
+                try:
+                    conn.settimeout(5)
+                    command = conn.recv(256).decode(errors="replace").split()
+                    conn.sendall((self._handle(command) + "\n").encode())
+                except (OSError, ValueError) as e:
+                    log.warning("Control socket error: %s", e)
+
+    def _handle(self, command):
+        if command and command[0] == "profile":
+            path = self.sampler.start(float(command[1]) if len(command) > 1 else 30)
+            return f"profiling -> {path}" if path else "busy: a profile is already running"
+        if command and command[0] == "status":
+            state = "running" if self.sampler.running else "idle"
+            return f"{state}; last profile: {self.sampler.last_path}"
+        return "unknown command (use: profile [seconds] | status)"
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Control the profiler of the running service")
+    parser.add_argument("command", nargs="+", help="profile [seconds] | status")
+    parser.add_argument("--socket", default=CONTROL_SOCKET)
+    args = parser.parse_args()
+
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+        client.connect(args.socket)
+        client.sendall(" ".join(args.command).encode())
+        print(client.recv(4096).decode().strip())
@@ -0,0 +1,168 @@
+# Local relay-state cache mirrored to board1/outputs/digital
+#
+# The cache is the single source of truth for relay outputs: both the
+# control loop and the dashboard listener change relays through it, and
+# only relays whose state actually changed are written back to Firebase,
+# each with one ETag-conditional PUT on its own child node.
+#
+# Conflict rules
+# 1. A dashboard command always wins over a local change that has not
+#    reached Firebase yet (the user's intent is never clobbered).
+# 2. A local change is written with if-match on the child's last known
+#    ETag. A 412 reply carries the current value and ETag:
+#    - if that value is one we have already seen (e.g. our stale ETag after
+#      a listener update), the write is retried once with the fresh ETag;
+#    - otherwise it is an unseen dashboard command and is applied locally
+#      under rule 1, dropping the local change. At start-up nothing has been
+#      seen yet, so whatever the dashboard left in Firebase is adopted rather
+#      than overwritten with the power-on defaults.
+# 3. Listener echoes of our own writes carry the value we already hold and
+#    change nothing.
+import threading  # Listener thread, main loop and Firebase loop share the cache
+import logging  # Report reconciliation results
+
+log = logging.getLogger("bms.relay")
+
+
+class _RelayEntry:
+    __slots__ = ("value", "version", "pushed", "remote", "etag", "in_flight")
+
+    def __init__(self, value):
+        self.value = value  # Current output: 1 = relay.on(), 0 = relay.off()
+        self.version = 0  # Bumped on every local change
+        self.pushed = -1  # Version confirmed in Firebase (-1: never written)
+        self.remote = None  # Last value seen in Firebase
+        self.etag = None  # ETag of that value, if known
+        self.in_flight = False  # A conditional write is outstanding
+
+
+class RelayStateMirror:
+    """
+    Owns the relay outputs and keeps board1/outputs/digital in step.
+    - pins: GPIO numbers (the Relay list)
+    - relays: gpiozero OutputDevice objects in the same order
+    - firebase: FirebaseBridge used for the conditional writes
+    """
+    def __init__(self, pins, relays, firebase, path="board1/outputs/digital"):
+        self.relays = dict(zip(pins, relays))
+        self.firebase = firebase
+        self.path = path
+        self.lock = threading.Lock()
+        self.entries = {gpio: _RelayEntry(1 if relay.value else 0)
+                        for gpio, relay in self.relays.items()}
+        self.on_change = []  # Callables (gpio, value, source) run after each actuation
+
+    def value(self, gpio):
+        return self.entries[gpio].value
+
+    def snapshot(self):
+        with self.lock:
+            return {gpio: entry.value for gpio, entry in self.entries.items()}
+
+    def _drive(self, gpio, value, source):
+        # Caller holds the lock
+        if value:
+            self.relays[gpio].on()
+        else:
+            self.relays[gpio].off()
+        self.entries[gpio].value = value
+        for callback in self.on_change:
+            callback(gpio, value, source)
+
+    def set_local(self, gpio, value):
+        """
+        Change a relay from the control loop.
+        Returns True if the output changed (and a write is now pending).
+        """
+        value = 1 if value else 0
+        with self.lock:
+            entry = self.entries[gpio]
+            if entry.value == value:
+                return False
+            self._drive(gpio, value, "local")
+            entry.version += 1
+            return True
+
+    def apply_remote(self, gpio, value):
+        """
+        Apply a value received from the dashboard listener (rules 1 and 3).
+        Returns True if the output changed.
+        """
+        value = 1 if int(value) else 0
+        with self.lock:
+            entry = self.entries[gpio]
+            if entry.remote != value:
+                entry.etag = None  # Our cached ETag no longer describes the node
+            entry.remote = value
+            changed = entry.value != value
+            if changed:
+                self._drive(gpio, value, "remote")
+            # Firebase already holds this value, nothing to write back
+            entry.version += 1
+            entry.pushed = entry.version
+            return changed
+
+    def pending(self):
+        with self.lock:
+            return [gpio for gpio, entry in self.entries.items()
+                    if entry.pushed != entry.version and not entry.in_flight]
+
+    def reconcile(self):
+        """
+        Queue one conditional write for every relay with an unconfirmed change.
+        Cheap no-op when everything is in sync; returns the GPIOs submitted.
+        """
+        submitted = []
+        with self.lock:
+            for gpio, entry in self.entries.items():
+                if entry.pushed == entry.version or entry.in_flight:
+                    continue
+                entry.in_flight = True
+                submitted.append((gpio, entry.value, entry.version, entry.etag))
+        for gpio, value, version, etag in submitted:
+            self.firebase.submit(self._push(gpio, value, version, etag))
+        return [gpio for gpio, *_ in submitted]
+
+    async def _push(self, gpio, value, version, etag):
+        client = self.firebase.client
+        path = f"{self.path}/{gpio}"
+        entry = self.entries[gpio]
+        try:
+            if etag is None:
+                # ETag unknown (start-up or after a dashboard change): fetch it
+                remote, etag = await client.get_with_etag(path)
+                if self._resolve(entry, gpio, value, version, False, remote, etag):
+                    return
+            for attempt in range(2):
+                written, remote, etag = await client.set_if_match(path, value, etag)
+                if self._resolve(entry, gpio, value, version, written, remote, etag):
+                    return
+        finally:
+            with self.lock:
+                entry.in_flight = False
+
+    def _resolve(self, entry, gpio, value, version, written, remote, etag):
+        """
+        Fold a server reply into the cache.
+        Returns True when done, False when the write should be (re)tried
+        with the fresh ETag.
+        """
+        if remote is not None:
+            remote = 1 if int(remote) else 0
+        with self.lock:
+            entry.etag = etag
+            if written or remote == value:
+                entry.remote = value
+                if entry.version == version:
+                    entry.pushed = version
+                return True
+            if remote is None or remote == entry.remote:
+                return False  # Empty node or a value we have seen, local change stands (rule 2)
+            # Unseen dashboard command wins (rule 1); this includes the value the
+            # dashboard left in Firebase before start-up, when nothing has been seen yet
+            log.info("GPIO %s: remote value %s wins over local %s", gpio, remote, value)
+            entry.remote = remote
+            self._drive(gpio, remote, "remote")
+            entry.version += 1
+            entry.pushed = entry.version
+            return True
@@ -0,0 +1,102 @@
+# Online internal-resistance estimate from load / charger steps
+#
+# When the current through the pack jumps between two consecutive samples
+# (a load switching, or the charger relay), the open-circuit voltage has
+# no time to move, so the voltage jump is ohmic: R = dV / dI.
+# Every accepted step updates an exponentially weighted mean and variance,
+# giving a running estimate with a confidence interval in O(1) per sample.
+import math  # Square root for the confidence interval
+
+Z_95 = 1.96  # Two-sided 95 % normal quantile
+
+
+class InternalResistanceEstimator:
+    """
+    Feed update(voltage, current, t) once per sample.
+    - current: amps, positive when charging (set current_sign=-1 if the
+      shunt is wired the other way round)
+    - min_step: smallest |dI| (A) treated as a step
+    - hint_step: smaller threshold used right after expect_step(), for
+      steps we caused ourselves (charger relay)
+    - max_dt: samples further apart than this (s) are not compared
+    - r_max: estimates outside (0, r_max] ohms are rejected as non-ohmic
+    - forgetting: weight kept by older steps per new step (1.0 = plain
+      running mean; below 1 tracks slow drift as the pack ages)
+    """
+    def __init__(self, min_step=0.5, hint_step=0.2, max_dt=5.0, r_max=1.0,
+                 forgetting=0.98, current_sign=1):
+        self.min_step = min_step
+        self.hint_step = hint_step
+        self.max_dt = max_dt
+        self.r_max = r_max
+        self.forgetting = forgetting
+        self.current_sign = current_sign
+        self.previous = None  # (voltage, current, t)
+        self.hint = 0  # Samples left during which the lower threshold applies
+        self.steps = 0  # Accepted steps
+        self.rejected = 0  # Steps rejected as non-ohmic
+        self._weight = 0.0  # Sum of weights
+        self._weight_sq = 0.0  # Sum of squared weights (effective sample size)
+        self._mean = 0.0
+        self._spread = 0.0  # Weighted sum of squared deviations
+
+    def expect_step(self, samples=2):
+        """
+        Lower the step threshold for the next few samples, e.g. right
+        after the charger relay switched.
+        """
+        self.hint = samples
+
+    def update(self, voltage, current, t):
+        """
+        Process one sample; returns the new estimate (ohms) when this sample
+        completed an accepted step, otherwise None.
+        """
+        if voltage is None or current is None:
+            self.previous = None  # Do not compare across a failed read
+            return None
+        current *= self.current_sign
+        previous, self.previous = self.previous, (voltage, current, t)
+        threshold = self.hint_step if self.hint > 0 else self.min_step
+        if self.hint > 0:
+            self.hint -= 1
+        if previous is None or t - previous[2] > self.max_dt:
+            return None
+        d_current = current - previous[1]
+        if abs(d_current) < threshold:
+            return None
+        resistance = (voltage - previous[0]) / d_current
+        if not 0.0 < resistance <= self.r_max:
+            self.rejected += 1
+            return None
+        self._add(resistance)
+        return resistance
+
+    def _add(self, value):
+        # Exponentially weighted Welford update
+        self.steps += 1
+        self._weight = self.forgetting * self._weight + 1.0
+        self._weight_sq = self.forgetting ** 2 * self._weight_sq + 1.0
+        delta = value - self._mean
+        self._mean += delta / self._weight
+        self._spread = self.forgetting * self._spread + delta * (value - self._mean)
+
+    @property
+    def estimate(self):
+        return self._mean if self.steps else None
+
+    @property
+    def stddev(self):
+        if self.steps < 2:
+            return None
+        return math.sqrt(max(self._spread, 0.0) / self._weight)
+
+    def confidence_interval(self, z=Z_95):
+        """
+        (low, high) bounds on the mean in ohms, or None before two steps.
+        """
+        if self.steps < 2:
+            return None
+        effective_n = self._weight ** 2 / self._weight_sq
+        half_width = z * self.stddev / math.sqrt(effective_n)
+        return self._mean - half_width, self._mean + half_width
@@ -0,0 +1,315 @@
+# Streaming export of a Realtime Database subtree to CSV or Parquet
+#
+# Downloading /UsersData/{uid}/readings in one GET times out and runs out of
+# memory once the tree is large. This pages through it instead:
+#   orderBy="$key" & startAt=<last key> & limitToFirst=<page size + 1>
+# and pushes each page through a generator pipeline
+#   fetch_pages -> to_rows -> sink
+# so only one page (plus the next one, already in flight) is ever in memory.
+# Output is written incrementally; a checkpoint file next to it records the
+# last exported key, so an interrupted export resumes where it stopped.
+# The columns are fixed when the export starts: every field a reading can
+# carry (READING_FIELDS) plus whatever else the first page has, or --fields.
+# Old readings lack the newer fields (current, ir_mohm, tte_s, ...), so they
+# are included up front; a field outside the schema turning up later stops
+# the export with an error rather than being dropped.
+#
+#   python rtdb_export.py --url https://<db>.firebasedatabase.app \
+#       --service-account key.json --path /UsersData/<uid>/readings --out readings.csv
+#   python rtdb_export.py ... --out readings_parquet --format parquet   (needs pyarrow)
+#
+# Try it locally:
+#   python fake_rtdb.py --port 9000 --demo-readings 100000
+#   python rtdb_export.py --url http://127.0.0.1:9000 --path /UsersData/demo/readings --out demo.csv
+import os  # Truncate / fsync / atomic checkpoint replace
+import sys  # Progress to stderr
+import csv  # CSV output
+import json  # Query values and the checkpoint file
+import argparse  # Command line options
+import logging  # Schema warnings
+from time import perf_counter
+
+from firebase_client import FirebaseBridge, admin_token_provider, key_order
+
+try:
+    import pyarrow  # Optional columnar output
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+log = logging.getLogger("bms.export")
+
+# Fields of an uploaded reading (Battery_managment_system_V14.upload_job)
+READING_FIELDS = ("timestamp", "voltage", "current", "temperature", "humidity",
+                  "ir_mohm", "ir_ci_mohm", "tte_s", "ttf_s")
+
+
+#%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%  Pipeline stages   %%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%
+
+def fetch_pages(bridge, path, page_size=1000, start_after=None, timeout=60.0):
+    """
+    Yield the children of path as lists of (key, value) in key order,
+    page_size at a time, starting after start_after. The next page is
+    requested before the current one is handed on, so the download of
+    page n + 1 overlaps the writing of page n.
+    """
+    def request(after):
+        query = {"orderBy": json.dumps("$key"), "limitToFirst": page_size}
+        if after is not None:
+            # startAt is inclusive: ask for one extra and drop the repeat
+            query.update(startAt=json.dumps(after), limitToFirst=page_size + 1)
+        return bridge.get(path, **query)
+
+    future = request(start_after)
+    while True:
+        page = future.result(timeout) or {}
+        items = sorted(page.items(), key=lambda item: key_order(item[0]))
+        if start_after is not None and items and items[0][0] == start_after:
+            items = items[1:]
+        if not items:
+            return
+        more = len(items) >= page_size
+        start_after = items[-1][0]
+        if more:
+            future = request(start_after)
+        yield items
+        if not more:
+            return
+
+
+def to_rows(pages):
+    """
+    Turn pages into lists of flat row dicts: {"key": key, **record}.
+    Scalar children become {"key": key, "value": value}.
+    """
+    for items in pages:
+        yield [dict(value, key=key) if isinstance(value, dict) else {"key": key, "value": value}
+               for key, value in items]
+
+
+def infer_fields(rows):
+    """
+    Column order for the export: key first, the reading fields, then any
+    other field seen in rows.
+    """
+    names = sorted({name for row in rows for name in row} - {"key"} - set(READING_FIELDS))
+    return ["key"] + list(READING_FIELDS) + names
+
+
+#%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%  Sinks   %%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%
+
+class CsvSink:
+    """
+    Appends rows to one CSV file. Every page is flushed and fsynced, so
+    each page is a safe resume point; on resume the file is cut back to the
+    last committed size, dropping any half-written page.
+    """
+    def __init__(self, path, fields, state=None):
+        self.path = path
+        self.fields = fields
+        if state:
+            os.truncate(path, state["bytes"])
+            self.file = open(path, "a", newline="")
+        else:
+            self.file = open(path, "w", newline="")
+        self.writer = csv.DictWriter(self.file, fieldnames=fields, extrasaction="ignore")
+        if not state:
+            self.writer.writeheader()
+
+    def write(self, rows):
+        """
+        Write one page; returns the sink state to checkpoint.
+        """
+        self.writer.writerows(rows)
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        return {"bytes": self.file.tell()}
+
+    def close(self):
+        self.file.close()
+        return {"bytes": os.path.getsize(self.path)}
+
+
+class ParquetSink:
+    """
+    Writes a directory of Parquet part files (part-00000.parquet, ...),
+    one row group per page. A part only becomes a resume point once it is
+    closed (its footer written), so parts are rotated every rows_per_part
+    rows; unfinished parts from an interrupted run are deleted on resume.
+    Column types come from the first page (numbers as float64) and are kept
+    in the checkpoint, so every part has the same schema.
+    Read the result with pyarrow.parquet.read_table(directory).
+    """
+    def __init__(self, path, fields, state=None, rows_per_part=100000):
+        if pyarrow is None:
+            raise RuntimeError("Parquet output needs the pyarrow package (pip install pyarrow)")
+        self.path = path
+        self.fields = fields
+        self.rows_per_part = rows_per_part
+        self.parts = list(state["parts"]) if state else []
+        self.types = dict(state["types"]) if state else None
+        self.schema = self._schema() if self.types else None
+        self.writer = None
+        self.current = None
+        self.part_rows = 0
+        os.makedirs(path, exist_ok=True)
+        for name in os.listdir(path):
+            if name.endswith(".parquet") and name not in self.parts:
+                os.remove(os.path.join(path, name))
+
+    def _infer_types(self, rows):
+        self.types = {}
+        for name in self.fields:
+            values = [row[name] for row in rows if row.get(name) is not None]
+            if name != "key" and values and all(isinstance(v, bool) for v in values):
+                self.types[name] = "bool_"
+            elif name != "key" and values and all(isinstance(v, (int, float)) for v in values):
+                self.types[name] = "float64"  # Readings are stored as 13 or 13.2 alike
+            elif not values and name in READING_FIELDS:
+                self.types[name] = "float64"  # Numeric reading field not on this page yet
+            else:
+                self.types[name] = "string"
+
+    def _schema(self):
+        # types holds pyarrow type factory names ("float64", "bool_", "string")
+        return pyarrow.schema([pyarrow.field(name, getattr(pyarrow, self.types[name])())
+                               for name in self.fields])
+
+    def _column(self, rows, field):
+        values = [row.get(field.name) for row in rows]
+        if pyarrow.types.is_string(field.type):
+            values = [None if v is None else str(v) for v in values]
+        elif pyarrow.types.is_floating(field.type):
+            values = [None if v is None else float(v) for v in values]
+        return values
+
+    def write(self, rows):
+        if self.schema is None:
+            self._infer_types(rows)
+            self.schema = self._schema()
+        if self.writer is None:
+            name = f"part-{len(self.parts):05d}.parquet"
+            self.writer = pyarrow.parquet.ParquetWriter(os.path.join(self.path, name), self.schema)
+            self.current = name
+        table = pyarrow.Table.from_arrays([self._column(rows, f) for f in self.schema], schema=self.schema)
+        self.writer.write_table(table)
+        self.part_rows += len(rows)
+        if self.part_rows >= self.rows_per_part:
+            self._close_part()
+            return {"parts": list(self.parts), "types": self.types}
+        return None  # Nothing durable yet
+
+    def _close_part(self):
+        self.writer.close()
+        self.parts.append(self.current)
+        self.writer = None
+        self.part_rows = 0
+
+    def close(self):
+        if self.writer is not None:
+            self._close_part()
+        return {"parts": list(self.parts), "types": self.types}
+
+
+#%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%  Export driver   %%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%
+
+def _save_checkpoint(path, state):
+    tmp = path + ".tmp"
+    with open(tmp, "w") as f:
+        json.dump(state, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+
+def export(bridge, path, out, fmt="csv", page_size=1000, fields=None, progress=None):
+    """
+    Export path to out, resuming from out + ".checkpoint" when present.
+    Returns the number of rows written by this run.
+    """
+    checkpoint_path = out.rstrip("/") + ".checkpoint"
+    state = None
+    if os.path.exists(checkpoint_path):
+        with open(checkpoint_path) as f:
+            state = json.load(f)
+        if state["path"] != path or state["format"] != fmt:
+            raise ValueError(f"{checkpoint_path} belongs to a {state['format']} export of {state['path']}")
+        if state.get("done"):
+            return 0
+
+    pages = to_rows(fetch_pages(bridge, path, page_size, state["last_key"] if state else None))
+    base_rows = state["rows"] if state else 0
+    sink = None
+    written = 0
+    for rows in pages:
+        if sink is None:
+            if state is None:
+                state = {"path": path, "format": fmt, "rows": 0, "last_key": None, "sink": None,
+                         "fields": ["key"] + list(fields) if fields else infer_fields(rows),
+                         "fields_given": bool(fields)}
+            sink_class = ParquetSink if fmt == "parquet" else CsvSink
+            sink = sink_class(out, state["fields"], state["sink"])
+        unknown = {name for row in rows for name in row} - set(state["fields"])
+        if unknown and state.get("fields_given"):
+            log.warning("Fields not in --fields are skipped: %s", sorted(unknown))
+        elif unknown:
+            sink.close()
+            raise ValueError(f"Fields {sorted(unknown)} appear in the page starting at key {rows[0]['key']} but are "
+                             f"not in the export schema; delete {out} and {checkpoint_path} and re-run "
+                             f"with --fields listing every column wanted")
+        sink_state = sink.write(rows)
+        written += len(rows)
+        last_key = rows[-1]["key"]
+        if sink_state is not None:  # Everything up to last_key is on disk
+            state.update(last_key=last_key, rows=base_rows + written, sink=sink_state)
+            _save_checkpoint(checkpoint_path, state)
+        if progress:
+            progress(base_rows + written, last_key)
+    if sink is not None:
+        state.update(last_key=last_key, rows=base_rows + written, sink=sink.close())
+    if state is not None:
+        state["done"] = True
+        _save_checkpoint(checkpoint_path, state)
+    return written
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Page a Realtime Database node out to CSV or Parquet")
+    parser.add_argument("--url", required=True, help="Database URL (or the fake_rtdb.py URL)")
+    parser.add_argument("--path", required=True, help="Node to export, e.g. /UsersData/<uid>/readings")
+    parser.add_argument("--out", required=True, help="CSV file, or directory for Parquet")
+    parser.add_argument("--format", choices=("csv", "parquet"), default=None,
+                        help="Default: parquet if --out ends in .parquet or _parquet, else csv")
+    parser.add_argument("--page-size", type=int, default=1000)
+    parser.add_argument("--fields", nargs="+",
+                        help="Columns to keep (default: the reading fields plus any on the first page)")
+    auth = parser.add_mutually_exclusive_group()
+    auth.add_argument("--service-account", help="Service account key JSON")
+    auth.add_argument("--token", help="OAuth2 access token")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(name)s: %(message)s")
+    fmt = args.format or ("parquet" if args.out.rstrip("/").endswith(("parquet", "_parquet")) else "csv")
+    if fmt == "parquet" and pyarrow is None:
+        parser.error("Parquet output needs the pyarrow package (pip install pyarrow)")
+    token_provider = None
+    if args.service_account:
+        from firebase_admin import credentials
+        token_provider = admin_token_provider(credentials.Certificate(args.service_account))
+    elif args.token:
+        token_provider = lambda: args.token
+
+    bridge = FirebaseBridge(args.url, token_provider=token_provider, max_connections=2)
+    start = perf_counter()
+    try:
+        count = export(bridge, args.path, args.out, fmt, args.page_size, args.fields,
+                       progress=lambda n, key: print(f"\r{n} rows, last key {key}", end="", file=sys.stderr))
+    except KeyboardInterrupt:
+        print("\nInterrupted; run the same command again to resume", file=sys.stderr)
+        sys.exit(1)
+    except ValueError as e:
+        print(f"\n{e}", file=sys.stderr)
+        sys.exit(1)
+    finally:
+        bridge.close()
+    print(f"\n{count} rows exported to {args.out} in {perf_counter() - start:.1f} s", file=sys.stderr)
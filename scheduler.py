@@ -0,0 +1,136 @@
+# Fixed-rate periodic job scheduler on the monotonic clock
+#
+# Each job runs on an absolute grid start + k * period taken from
+# time.monotonic_ns(), so the time spent doing work never stretches the
+# period and NTP / wall-clock steps cannot skip or double a run.
+# Jobs due at the same tick run in priority order (lower number first).
+# A run that starts so late that whole periods were missed is an overrun:
+# the missed slots are skipped (never run back to back to catch up),
+# counted and logged.
+import threading  # Interruptible sleep / stop from other threads
+import logging  # Overrun and job error reports
+from time import monotonic_ns
+
+log = logging.getLogger("bms.scheduler")
+
+NS = 1000000000  # Nanoseconds per second
+
+
+class PeriodicJob:
+    """
+    One job and its timing statistics (all times in ns).
+    """
+    def __init__(self, name, period_ns, func, priority, next_due):
+        self.name = name
+        self.period_ns = period_ns
+        self.func = func
+        self.priority = priority
+        self.next_due = next_due
+        self.runs = 0
+        self.errors = 0
+        self.overruns = 0  # Runs that started one or more periods late
+        self.missed = 0  # Grid slots skipped because of overruns
+        self.max_late_ns = 0  # Worst start lateness (jitter)
+        self.max_runtime_ns = 0
+        self.total_runtime_ns = 0
+
+    def stats(self):
+        return {
+            "period_s": self.period_ns / NS,
+            "runs": self.runs,
+            "errors": self.errors,
+            "overruns": self.overruns,
+            "missed": self.missed,
+            "max_late_ms": self.max_late_ns / 1e6,
+            "max_runtime_ms": self.max_runtime_ns / 1e6,
+            "mean_runtime_ms": self.total_runtime_ns / self.runs / 1e6 if self.runs else 0.0,
+        }
+
+
+class TickScheduler:
+    """
+    Runs PeriodicJobs on the calling thread until stop() is called.
+    - clock: nanosecond monotonic clock (replaceable for replay/tests)
+    """
+    def __init__(self, clock=monotonic_ns):
+        self.clock = clock
+        self.jobs = []
+        self._stop = threading.Event()
+        self.lock = threading.Lock()
+
+    def add_job(self, name, period_s, func, priority=0, offset_s=0.0):
+        """
+        Schedule func() every period_s seconds, first run offset_s from now.
+        """
+        job = PeriodicJob(name, int(period_s * NS), func, priority,
+                          self.clock() + int(offset_s * NS))
+        with self.lock:
+            self.jobs.append(job)
+            self.jobs.sort(key=lambda j: j.priority)
+        return job
+
+    def set_period(self, name, period_s):
+        """
+        Change a job's period (e.g. timer_delay from a config reload);
+        the new grid starts from the job's next due time.
+        """
+        with self.lock:
+            for job in self.jobs:
+                if job.name == name:
+                    job.period_ns = int(period_s * NS)
+
+    def stop(self):
+        self._stop.set()
+
+    def stats(self):
+        with self.lock:
+            return {job.name: job.stats() for job in self.jobs}
+
+    def run_pending(self):
+        """
+        Run every job that is due now, in priority order.
+        Returns the ns until the next job is due.
+        """
+        with self.lock:
+            jobs = list(self.jobs)
+        for job in jobs:
+            now = self.clock()
+            if now < job.next_due:
+                continue
+            late = now - job.next_due
+            job.max_late_ns = max(job.max_late_ns, late)
+            started = now
+            try:
+                job.func()
+            except Exception:
+                job.errors += 1
+                log.exception("Job %s failed", job.name)
+            finished = self.clock()
+            runtime = finished - started
+            job.runs += 1
+            job.total_runtime_ns += runtime
+            job.max_runtime_ns = max(job.max_runtime_ns, runtime)
+
+            # Next slot on the fixed grid; skip any slot that has already passed
+            job.next_due += job.period_ns
+            if job.next_due <= finished:
+                missed = (finished - job.next_due) // job.period_ns + 1
+                job.next_due += missed * job.period_ns
+                job.missed += missed
+                job.overruns += 1
+                log.warning("Job %s overran: started %.1f ms late, ran %.1f ms, skipped %d slot(s)",
+                            job.name, late / 1e6, runtime / 1e6, missed,
+                            extra={"job": job.name, "late_ms": late / 1e6,
+                                   "runtime_ms": runtime / 1e6, "missed": missed})
+        with self.lock:
+            next_due = min((job.next_due for job in self.jobs), default=None)
+        return None if next_due is None else max(0, next_due - self.clock())
+
+    def run(self):
+        """
+        Loop until stop(); sleeps exactly until the next job is due.
+        """
+        self._stop.clear()
+        while not self._stop.is_set():
+            wait_ns = self.run_pending()
+            self._stop.wait(1.0 if wait_ns is None else wait_ns / NS)
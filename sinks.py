@@ -0,0 +1,302 @@
+# Output fan-out: every reading to several sinks without blocking main_loop
+#
+# FanOut.publish() only appends the reading to one bounded queue per sink.
+# Each sink has its own worker thread that takes batches off its queue
+# and retries failed writes with exponential backoff, so a slow or
+# unreachable sink (on-prem time-series DB, full SD card) never delays the
+# sampler or the other sinks. A full queue drops its oldest reading.
+#
+# Sinks
+#   FirebaseSink     multi-path update under the readings node (via FirebaseBridge)
+#   CsvFileSink      appends rows to a local CSV file
+#   LineProtocolSink InfluxDB line protocol over TCP (Telegraf socket_listener,
+#                    InfluxDB 1.x TCP input, ...)
+#
+# Demo with a local TCP stand-in for the time-series database:
+#   python sinks.py
+import csv  # CSV sink
+import socket  # Line protocol over TCP
+import threading  # One worker per sink
+import logging  # Failed writes
+from collections import deque  # Bounded per-sink queues
+from time import monotonic
+
+log = logging.getLogger("bms.sinks")
+
+
+#%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%  Sink interface   %%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%
+
+class Sink:
+    """
+    Destination for readings. write_batch() gets a list of reading dicts
+    (each with an integer "timestamp") and raises on failure; it runs on
+    the sink's own worker thread only.
+    """
+    name = "sink"
+
+    def write_batch(self, batch):
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+class FirebaseSink(Sink):
+    """
+    One multi-path update per batch: {timestamp: reading} under base_path.
+    """
+    name = "firebase"
+
+    def __init__(self, bridge, base_path, timeout=30.0):
+        self.bridge = bridge
+        self.base_path = base_path
+        self.timeout = timeout
+
+    def write_batch(self, batch):
+        update = {str(reading["timestamp"]): reading for reading in batch}
+        self.bridge.update(self.base_path, update).result(self.timeout)
+
+
+class CsvFileSink(Sink):
+    """
+    Appends readings to a CSV file; the header is written for a new file.
+    Fields outside `fields` are ignored, missing ones left empty.
+    """
+    name = "csv"
+
+    def __init__(self, path, fields=("timestamp", "voltage", "current", "temperature", "humidity")):
+        self.path = path
+        self.file = open(path, "a", newline="")
+        self.writer = csv.DictWriter(self.file, fieldnames=list(fields), extrasaction="ignore")
+        if self.file.tell() == 0:
+            self.writer.writeheader()
+
+    def write_batch(self, batch):
+        self.writer.writerows(batch)
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+
+def _escape(text, special):
+    for char in "\\" + special:
+        text = text.replace(char, "\\" + char)
+    return text
+
+
+def to_line_protocol(measurement, tags, reading):
+    """
+    One line-protocol line; numbers are written as floats so a value that
+    happens to be whole (13 V) never changes the field type.
+    """
+    fields = []
+    for key, value in reading.items():
+        if key == "timestamp" or value is None:
+            continue
+        if isinstance(value, bool):
+            text = "true" if value else "false"
+        elif isinstance(value, (int, float)):
+            text = repr(float(value))
+        else:
+            text = '"' + str(value).replace("\\", "\\\\").replace('"', '\\"') + '"'
+        fields.append(f"{_escape(key, ',= ')}={text}")
+    if not fields:
+        return None
+    tag_text = "".join(f",{_escape(k, ',= ')}={_escape(str(v), ',= ')}" for k, v in sorted(tags.items()))
+    return f"{_escape(measurement, ', ')}{tag_text} {','.join(fields)} {int(reading['timestamp']) * 1000000000}\n"
+
+
+class LineProtocolSink(Sink):
+    """
+    InfluxDB line protocol over a persistent TCP connection, reconnecting
+    after errors.
+    """
+    name = "influx"
+
+    def __init__(self, host, port, measurement="battery", tags=None, timeout=10.0):
+        self.address = (host, port)
+        self.measurement = measurement
+        self.tags = tags or {}
+        self.timeout = timeout
+        self.sock = None
+
+    def write_batch(self, batch):
+        lines = (to_line_protocol(self.measurement, self.tags, reading) for reading in batch)
+        payload = "".join(line for line in lines if line).encode()
+        if not payload:
+            return
+        try:
+            if self.sock is None:
+                self.sock = socket.create_connection(self.address, self.timeout)
+            self.sock.sendall(payload)
+        except OSError:
+            self.close()  # Reconnect on the retry
+            raise
+
+    def close(self):
+        if self.sock is not None:
+            self.sock.close()
+            self.sock = None
+
+
+#%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%  Fan-out   %%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%
+
+class SinkWorker:
+    """
+    Bounded queue and worker thread for one sink.
+    - queue_size: readings held while the sink is slow or down (oldest dropped)
+    - batch_size / max_wait: a batch is sent when full or max_wait s after
+      its first reading arrived
+    - retries / backoff: attempts after the first failure, with the delay
+      doubling from backoff[0] up to backoff[1] seconds
+    - on_give_up: called with a batch that failed every attempt
+    """
+    def __init__(self, sink, queue_size=1000, batch_size=50, max_wait=1.0,
+                 retries=5, backoff=(1.0, 60.0), on_give_up=None):
+        self.sink = sink
+        self.queue = deque()
+        self.queue_size = queue_size
+        self.batch_size = batch_size
+        self.max_wait = max_wait
+        self.retries = retries
+        self.backoff = backoff
+        self.on_give_up = on_give_up
+        self.cond = threading.Condition()
+        self.stopping = threading.Event()
+        self.sent = self.dropped = self.failures = self.given_up = 0
+        self.thread = threading.Thread(target=self._run, name=f"sink-{sink.name}", daemon=True)
+        self.thread.start()
+
+    def put(self, reading):
+        with self.cond:
+            if len(self.queue) >= self.queue_size:
+                self.queue.popleft()
+                self.dropped += 1
+            self.queue.append(reading)
+            if len(self.queue) == 1 or len(self.queue) >= self.batch_size:
+                self.cond.notify()
+
+    def stats(self):
+        with self.cond:
+            queued = len(self.queue)
+        return {"queued": queued, "sent": self.sent, "dropped": self.dropped,
+                "failures": self.failures, "given_up": self.given_up}
+
+    def _run(self):
+        while True:
+            with self.cond:
+                while not self.queue and not self.stopping.is_set():
+                    self.cond.wait()
+                if not self.queue:
+                    return  # Stopping and drained
+                deadline = monotonic() + self.max_wait
+                while len(self.queue) < self.batch_size and not self.stopping.is_set():
+                    remaining = deadline - monotonic()
+                    if remaining <= 0:
+                        break
+                    self.cond.wait(remaining)
+                batch = [self.queue.popleft() for _ in range(min(self.batch_size, len(self.queue)))]
+            self._deliver(batch)
+
+    def _deliver(self, batch):
+        delay = self.backoff[0]
+        for attempt in range(self.retries + 1):
+            try:
+                self.sink.write_batch(batch)
+                self.sent += len(batch)
+                return
+            except Exception as e:
+                self.failures += 1
+                log.warning("Sink %s failed to write %d readings (attempt %d): %r",
+                            self.sink.name, len(batch), attempt + 1, e)
+            if attempt == self.retries or self.stopping.wait(delay):
+                break  # Out of attempts, or shutting down
+            delay = min(delay * 2, self.backoff[1])
+        self.given_up += len(batch)
+        if self.on_give_up is not None:
+            self.on_give_up(batch)
+
+    def close(self, timeout):
+        self.stopping.set()
+        with self.cond:
+            self.cond.notify()
+        self.thread.join(timeout)
+        self.sink.close()
+
+
+class FanOut:
+    """
+    Publishes every reading to all registered sinks; never blocks.
+    """
+    def __init__(self):
+        self.workers = []
+
+    def add(self, sink, **options):
+        """
+        Register a sink; options are SinkWorker keyword arguments.
+        """
+        worker = SinkWorker(sink, **options)
+        self.workers.append(worker)
+        return worker
+
+    def publish(self, reading):
+        for worker in self.workers:
+            worker.put(reading)
+
+    def stats(self):
+        return {worker.sink.name: worker.stats() for worker in self.workers}
+
+    def close(self, timeout=10.0):
+        """
+        Flush what each sink can deliver within timeout, then stop.
+        """
+        for worker in self.workers:
+            worker.close(timeout)
+
+
+if __name__ == "__main__":
+    import os
+    import tempfile
+    import socketserver
+    from time import perf_counter, sleep
+
+    class _Counter(socketserver.StreamRequestHandler):
+        def handle(self):
+            for line in self.rfile:
+                self.server.lines.append(line)
+
+    # Local stand-in for the time-series database: counts received lines
+    server = socketserver.ThreadingTCPServer(("127.0.0.1", 0), _Counter)
+    server.daemon_threads = True
+    server.lines = []
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    class _SlowSink(Sink):
+        name = "slow"
+
+        def write_batch(self, batch):
+            sleep(0.5)  # A sink far slower than the sample rate
+
+    logging.basicConfig(level=logging.ERROR)
+    count = 20000
+    csv_path = os.path.join(tempfile.mkdtemp(), "readings.csv")
+    fanout = FanOut()
+    fanout.add(CsvFileSink(csv_path), queue_size=count, batch_size=500, max_wait=0.2)
+    fanout.add(LineProtocolSink("127.0.0.1", server.server_address[1], tags={"board": "board1"}),
+               queue_size=count, batch_size=500, max_wait=0.2)
+    # The slow sink only keeps its newest 200 readings, without holding up the others
+    fanout.add(_SlowSink(), queue_size=200, batch_size=10, max_wait=0.2)
+
+    start = perf_counter()
+    for k in range(count):
+        fanout.publish({"timestamp": 1700000000 + k, "voltage": 13.2, "current": -1.5,
+                        "temperature": 21.0, "humidity": 45.0})
+    publish_s = perf_counter() - start
+    sleep(1.0)
+    print(f"publish(): {publish_s / count * 1e6:.2f} us per reading with 3 sinks")
+    for name, stats in fanout.stats().items():
+        print(f"  {name:<7} {stats}")
+    print(f"  line protocol stand-in received {len(server.lines)} lines, e.g. {server.lines[0].decode().strip()}")
+    fanout.close(timeout=2.0)
+    server.shutdown()
@@ -0,0 +1,46 @@
+# Spike vs level-shift classification of the anomaly detector
+#
+#   python -m pytest -q test_anomaly.py
+import random
+
+from anomaly import ChannelDetector
+
+
+def feed(detector, values):
+    events = []
+    for t, value in enumerate(values):
+        event = detector.update(value, t)
+        if event is not None:
+            events.append(event)
+    return events
+
+
+def steady(n, level=13.3, seed=1):
+    rng = random.Random(seed)
+    return [round(level + rng.gauss(0, 0.01), 2) for _ in range(n)]
+
+
+def test_single_bad_reading_is_a_spike():
+    values = steady(300)
+    values[200] += 1.5
+    events = feed(ChannelDetector("voltage", min_std=0.02), values)
+    assert [(e["kind"], e["t"]) for e in events] == [("spike", 200)]
+
+
+def test_persistent_step_is_a_shift_and_rebaselines():
+    # Regression: a 0.4 V drop (cell short) was reported as a one-off spike
+    values = steady(300) + steady(300, level=12.9, seed=2)
+    detector = ChannelDetector("voltage", min_std=0.02)
+    events = feed(detector, values)
+    assert [(e["kind"], e["t"]) for e in events] == [("shift_down", 300)]
+    assert abs(detector.level - 12.9) < 0.05
+
+
+def test_spike_before_expected_step_is_still_reported():
+    values = steady(300)
+    values[200] += 1.5
+    detector = ChannelDetector("voltage", min_std=0.02)
+    events = feed(detector, values[:201])
+    detector.rebaseline(5)  # e.g. the charger switched off because of the spike
+    events += feed(detector, values[201:])
+    assert [e["kind"] for e in events] == ["spike"]
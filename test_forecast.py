@@ -0,0 +1,80 @@
+# Voltage-trend forecasts and the pre-emptive charger start
+#
+#   python -m pytest -q test_forecast.py
+import math
+
+from forecast import TrendForecaster, SETTLE_S
+from trace_replay import ReplayController
+
+LOW, HIGH = 13.2, 14.3
+
+
+def run_pack(controller, seconds, plateau=13.45, tau=300.0, sag=-2e-5):
+    """
+    Closed-loop pack at 1 sample/s: the charge ramps 2 mV/s; after the cut-off
+    the voltage relaxes exponentially to the plateau while the load slowly
+    discharges it. Returns the times at which the charger switched on.
+    """
+    v = off_at = v_off = None
+    starts = []
+    for t in range(seconds):
+        if v is None:
+            v = v_off = plateau
+            off_at = t
+        elif controller.relays[controller.charger_relay] == 0:  # Relay off = charger on
+            v += 0.002
+        else:
+            v = plateau + (v_off - plateau) * math.exp(-(t - off_at) / tau) + sag * (t - off_at)
+        before = controller.relays[controller.charger_relay]
+        controller.sensor({"voltage": v}, float(t))
+        after = controller.relays[controller.charger_relay]
+        if after != before:
+            if after == 0:
+                starts.append(t)
+            else:
+                off_at, v_off = t, v
+    return starts
+
+
+def controller(lead_time):
+    ctrl = ReplayController(LOW, HIGH, lead_time=lead_time)
+    ctrl.relays.update({5: 1, 6: 1})  # Charger off, automatic control
+    return ctrl
+
+
+def test_flat_plateau_gives_no_forecast():
+    forecaster = TrendForecaster()
+    for t in range(1800):
+        forecaster.update(t, 13.27)
+    assert forecaster.time_to(LOW) is None
+
+
+def test_steady_discharge_is_forecast():
+    forecaster = TrendForecaster()
+    for t in range(1800):
+        forecaster.update(t, 13.5 - 1e-4 * t)
+    assert abs(forecaster.time_to(LOW) - 1201) < 5
+
+
+def test_hold_off_skips_samples_after_reset():
+    forecaster = TrendForecaster(min_samples=10)
+    forecaster.reset(hold_off=100.0)
+    for t in range(100):
+        forecaster.update(t, 14.3 - 0.001 * t)
+    assert forecaster.n == 0
+    forecaster.update(100, 13.4)
+    assert forecaster.n == 1
+
+
+def test_relaxation_after_charge_does_not_restart_charger():
+    # Regression: the fall from the charge voltage to the resting plateau
+    # used to forecast the low threshold within minutes, so with a long lead
+    # the charger came back on min_samples after every cut-off
+    plain = run_pack(controller(0.0), 12 * 3600)
+    early = run_pack(controller(3600.0), 12 * 3600)
+    assert len(plain) == 3
+    gaps = [b - a for a, b in zip(early, early[1:])]
+    assert len(gaps) >= 2
+    assert min(gaps) > 2 * SETTLE_S  # Was ~5 min
+    # The pre-emptive start still comes about lead_time before the crossing
+    assert 3000 < plain[0] - early[0] < 3700
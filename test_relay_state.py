@@ -0,0 +1,126 @@
+# Conflict rules of RelayStateMirror against the local fake database
+#
+#   python -m pytest -q test_relay_state.py
+from time import monotonic, sleep
+
+import pytest
+
+from fake_rtdb import FakeRealtimeDatabase
+from firebase_client import FirebaseBridge
+from relay_state import RelayStateMirror
+
+PATH = "board1/outputs/digital"
+PINS = (5, 6, 13)
+
+
+class FakeRelay:
+    def __init__(self, value=1):
+        self.value = value
+
+    def on(self):
+        self.value = 1
+
+    def off(self):
+        self.value = 0
+
+
+@pytest.fixture
+def database():
+    with FakeRealtimeDatabase() as fake:
+        yield fake
+
+
+@pytest.fixture
+def bridge(database):
+    bridge = FirebaseBridge(database.url)
+    yield bridge
+    bridge.close()
+
+
+def make_mirror(bridge, values=(1, 1, 1)):
+    relays = [FakeRelay(value) for value in values]
+    return RelayStateMirror(PINS, relays, bridge, path=PATH), relays
+
+
+def sync(mirror, timeout=5.0):
+    """
+    reconcile() and wait until no conditional write is outstanding.
+    """
+    submitted = mirror.reconcile()
+    deadline = monotonic() + timeout
+    while any(mirror.entries[gpio].in_flight for gpio in PINS):
+        assert monotonic() < deadline, "conditional writes did not finish"
+        sleep(0.01)
+    return submitted
+
+
+def node(database):
+    return {int(gpio): value for gpio, value in (database.tree.get(PATH) or {}).items()}
+
+
+def test_empty_node_is_written_at_startup(database, bridge):
+    mirror, _ = make_mirror(bridge, (1, 0, 1))
+    assert sorted(sync(mirror)) == list(PINS)
+    assert node(database) == {5: 1, 6: 0, 13: 1}
+    assert mirror.pending() == []
+
+
+def test_dashboard_state_in_firebase_wins_at_startup(database, bridge):
+    # Rule 1: what the dashboard saved before the service started is not
+    # overwritten by the power-on defaults, even before the listener runs
+    database.tree.set(PATH, {"5": 1, "6": 0, "13": 0})
+    mirror, relays = make_mirror(bridge, (1, 1, 1))
+    sync(mirror)
+    assert node(database) == {5: 1, 6: 0, 13: 0}
+    assert [relay.value for relay in relays] == [1, 0, 0]
+    assert mirror.snapshot() == {5: 1, 6: 0, 13: 0}
+    assert mirror.pending() == []
+
+
+def test_dashboard_command_beats_unsent_local_change(database, bridge):
+    mirror, relays = make_mirror(bridge)
+    sync(mirror)
+    assert mirror.set_local(5, 0)
+    # The listener delivers a dashboard command before the write went out
+    database.tree.set(f"{PATH}/5", 1)
+    assert mirror.apply_remote(5, 1)  # Back on; the local change is dropped
+    assert mirror.pending() == []
+    assert sync(mirror) == []
+    assert relays[0].value == 1
+    assert node(database)[5] == 1
+
+
+def test_local_change_after_seen_remote_is_written(database, bridge):
+    # Rule 2: a stale ETag on a value we have already seen is retried
+    mirror, relays = make_mirror(bridge)
+    sync(mirror)
+    database.tree.set(f"{PATH}/6", 0)
+    assert mirror.apply_remote(6, 0)
+    assert relays[1].value == 0
+    assert mirror.set_local(6, 1)
+    assert sync(mirror) == [6]
+    assert node(database)[6] == 1
+    assert mirror.pending() == []
+
+
+def test_stale_etag_with_seen_value_is_retried(database, bridge):
+    mirror, _ = make_mirror(bridge)
+    sync(mirror)
+    # Someone rewrote the same value: new ETag, nothing unseen
+    entry = mirror.entries[13]
+    entry.etag = "stale"
+    assert mirror.set_local(13, 0)
+    assert sync(mirror) == [13]
+    assert node(database)[13] == 0
+    assert mirror.value(13) == 0
+
+
+def test_listener_echo_changes_nothing(database, bridge):
+    # Rule 3
+    mirror, _ = make_mirror(bridge)
+    sync(mirror)
+    changes = []
+    mirror.on_change.append(lambda gpio, value, source: changes.append((gpio, value, source)))
+    assert not mirror.apply_remote(5, 1)
+    assert mirror.pending() == []
+    assert changes == []
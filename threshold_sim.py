@@ -0,0 +1,233 @@
+# What-if simulator for the charger thresholds
+#
+# Replays a trace through charger_policy.charger_decision (the logic
+# main_loop runs) for every (LOW_THRESHOLD, HIGH_THRESHOLD) pair in a grid,
+# fanned out over a ProcessPoolExecutor, and reports per pair:
+#   relay cycles, hours outside the safe voltage band, charger energy (Wh)
+# With --lead S the pre-emptive start (preemptive_lead_s) is simulated too,
+# with the same voltage-trend forecaster and settling rules as the Pi.
+#
+# Traces
+#   - CSV with timestamp and current (A, positive = charging): closed loop.
+#     The load is taken from the discharge current and a simple LiFePO4 4S
+#     model turns SoC + current into voltage, so each policy sees the
+#     consequences of its own switching.
+#   - CSV with timestamp and voltage only: open loop. Recorded voltages are
+#     replayed as-is; energy assumes the nominal charger current.
+#   - --synthetic DAYS: generated closed-loop load profile.
+#
+#   python threshold_sim.py --synthetic 30 --low 12.9:13.3:0.02 --high 13.9:14.5:0.02
+import csv  # Trace input and results output
+import sys  # Results to stdout
+import random  # Synthetic load profile
+import argparse  # Command line options
+import os  # CPU count
+from bisect import bisect_right  # OCV table lookup
+from concurrent.futures import ProcessPoolExecutor
+from time import perf_counter
+
+from charger_policy import charger_decision
+from forecast import TrendForecaster, SETTLE_S
+
+
+#%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%  Battery model   %%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%
+
+class BatteryModel:
+    """
+    Minimal 12 V LiFePO4 (4S) pack: piecewise-linear OCV(SoC), series
+    resistance and a polarisation term that rises steeply near full charge
+    while charging (the CV knee).
+    """
+    OCV_SOC = (0.0, 0.1, 0.2, 0.3, 0.7, 0.9, 0.99, 1.0)
+    OCV_VOLTS = (11.6, 12.8, 13.0, 13.15, 13.25, 13.35, 13.6, 13.8)
+
+    def __init__(self, capacity_ah=100.0, r_internal=0.02, charger_current=10.0, initial_soc=0.6):
+        self.capacity_ah = capacity_ah
+        self.r_internal = r_internal
+        self.charger_current = charger_current
+        self.initial_soc = initial_soc
+
+    def ocv(self, soc):
+        i = min(max(bisect_right(self.OCV_SOC, soc) - 1, 0), len(self.OCV_SOC) - 2)
+        s0, s1 = self.OCV_SOC[i], self.OCV_SOC[i + 1]
+        v0, v1 = self.OCV_VOLTS[i], self.OCV_VOLTS[i + 1]
+        return v0 + (v1 - v0) * (soc - s0) / (s1 - s0)
+
+    def voltage(self, soc, current, charging):
+        polarisation = 0.8 * soc ** 12 if charging else 0.0
+        return self.ocv(soc) + current * self.r_internal + polarisation
+
+
+#%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%  Traces   %%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%
+
+def load_trace(path):
+    """
+    Read a CSV trace into {"t": [...], "load": [...]} (closed loop, needs a
+    current column) or {"t": [...], "voltage": [...]} (open loop).
+    """
+    t, load, volts = [], [], []
+    with open(path, newline="") as f:
+        for row in csv.DictReader(f):
+            t.append(float(row["timestamp"]))
+            if row.get("current") not in (None, ""):
+                # Discharge current is the load; while charging it is hidden,
+                # so hold the last known load
+                current = float(row["current"])
+                load.append(-current if current < 0 else (load[-1] if load else 0.0))
+            elif row.get("voltage") not in (None, ""):
+                volts.append(float(row["voltage"]))
+    if load and len(load) == len(t):
+        return {"t": t, "load": load}
+    if volts and len(volts) == len(t):
+        return {"t": t, "voltage": volts}
+    raise ValueError(f"{path}: needs a current column, or a voltage column on every row")
+
+
+def synthetic_trace(days, step=18.0, seed=1):
+    """
+    Load profile in amps: base load, a daytime hump and random heavy
+    loads lasting minutes to hours.
+    """
+    rng = random.Random(seed)
+    t, load = [], []
+    heavy_until, heavy = 0.0, 0.0
+    now = 0.0
+    while now < days * 86400:
+        hour = (now / 3600) % 24
+        if now >= heavy_until and rng.random() < step / 7200:
+            heavy = rng.uniform(3, 15)
+            heavy_until = now + rng.uniform(300, 3 * 3600)
+        extra = heavy if now < heavy_until else 0.0
+        t.append(now)
+        load.append(1.0 + (2.0 if 8 <= hour < 20 else 0.0) + extra + rng.gauss(0, 0.1))
+        now += step
+    return {"t": t, "load": load}
+
+
+#%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%  Simulation   %%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%
+
+def simulate(trace, low, high, model, band=(13.0, 14.4), lead_time=0.0):
+    """
+    Run one threshold pair over the trace. Returns a result dict.
+    lead_time > 0 adds the forecast-based pre-emptive start.
+    """
+    t = trace["t"]
+    closed_loop = "load" in trace
+    load = trace.get("load")
+    volts = trace.get("voltage")
+    decide = charger_decision
+    band_low, band_high = band
+    charger_current = model.charger_current
+    capacity_as = model.capacity_ah * 3600.0  # Amp-seconds
+    soc = model.initial_soc
+    charger_on = False
+    cycles = 0
+    out_of_band = 0.0
+    energy = 0.0  # Watt-seconds
+    min_soc = soc
+    forecaster = None
+    if lead_time > 0 and len(t) > 1:
+        # Same 30 min window as the Pi; its 120 one-second samples before the
+        # first forecast become 120 s of samples here (at least 20)
+        step = (t[-1] - t[0]) / (len(t) - 1)
+        forecaster = TrendForecaster(window=1800.0, min_samples=max(20, int(120 / step)))
+    time_to_low = None
+
+    for k in range(len(t) - 1):
+        dt = t[k + 1] - t[k]
+        if closed_loop:
+            current = (charger_current if charger_on else 0.0) - load[k]
+            v = model.voltage(soc, current, charger_on)
+        else:
+            v = volts[k]
+        if forecaster is not None:
+            forecaster.update(t[k], v)
+            time_to_low = None if charger_on else forecaster.time_to(low)
+        new_state = decide(v, charger_on, low, high, time_to_low, lead_time)
+        if new_state and not charger_on:
+            cycles += 1
+        if forecaster is not None and new_state != charger_on:
+            forecaster.reset(0.0 if new_state else SETTLE_S)
+        charger_on = new_state
+        if v < band_low or v > band_high:
+            out_of_band += dt
+        if charger_on:
+            energy += v * charger_current * dt
+        if closed_loop:
+            current = (charger_current if charger_on else 0.0) - load[k]
+            soc += current * dt / capacity_as
+            soc = 0.0 if soc < 0.0 else 1.0 if soc > 1.0 else soc
+            if soc < min_soc:
+                min_soc = soc
+
+    return {"low": round(low, 4), "high": round(high, 4), "relay_cycles": cycles,
+            "out_of_band_h": round(out_of_band / 3600, 3), "energy_wh": round(energy / 3600, 1),
+            "min_soc": round(min_soc, 3) if closed_loop else None}
+
+
+# Worker processes receive the trace once (initializer), then only parameter batches
+_worker = {}
+
+
+def _init_worker(trace, model, band, lead_time):
+    _worker.update(trace=trace, model=model, band=band, lead_time=lead_time)
+
+
+def _run_batch(pairs):
+    return [simulate(_worker["trace"], low, high, _worker["model"], _worker["band"], _worker["lead_time"])
+            for low, high in pairs]
+
+
+def sweep(trace, pairs, model, band=(13.0, 14.4), workers=None, batch_size=8, lead_time=0.0):
+    """
+    Simulate every (low, high) pair in parallel; results keep pair order.
+    """
+    batches = [pairs[i:i + batch_size] for i in range(0, len(pairs), batch_size)]
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                             initargs=(trace, model, band, lead_time)) as pool:
+        return [result for batch in pool.map(_run_batch, batches) for result in batch]
+
+
+def parse_range(text):
+    """
+    "13.0:13.4:0.05" -> [13.0, 13.05, ...]; a single number is one value.
+    """
+    parts = [float(x) for x in text.split(":")]
+    if len(parts) == 1:
+        return parts
+    start, stop, step = parts
+    count = int(round((stop - start) / step)) + 1
+    return [start + i * step for i in range(count)]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Charger threshold what-if simulator")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--trace", help="CSV trace (timestamp + current, or timestamp + voltage)")
+    source.add_argument("--synthetic", type=float, metavar="DAYS", help="Generate a load profile")
+    parser.add_argument("--low", default="12.9:13.3:0.05", help="start:stop:step or a value")
+    parser.add_argument("--high", default="13.9:14.5:0.05", help="start:stop:step or a value")
+    parser.add_argument("--band", default="13.0:14.4", help="Safe voltage band low:high")
+    parser.add_argument("--capacity", type=float, default=100.0, help="Pack capacity (Ah)")
+    parser.add_argument("--charger-current", type=float, default=10.0, help="A")
+    parser.add_argument("--lead", type=float, default=0.0,
+                        help="preemptive_lead_s to simulate (s, 0 = plain hysteresis)")
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--sort", default="relay_cycles", help="Result column to sort by")
+    args = parser.parse_args()
+
+    trace = synthetic_trace(args.synthetic) if args.synthetic else load_trace(args.trace)
+    model = BatteryModel(capacity_ah=args.capacity, charger_current=args.charger_current)
+    band = tuple(float(x) for x in args.band.split(":"))
+    pairs = [(low, high) for low in parse_range(args.low) for high in parse_range(args.high) if low < high]
+
+    start = perf_counter()
+    results = sweep(trace, pairs, model, band, workers=args.workers, lead_time=args.lead)
+    elapsed = perf_counter() - start
+    print(f"{len(pairs)} combinations x {len(trace['t'])} samples in {elapsed:.1f} s "
+          f"on {args.workers} workers", file=sys.stderr)
+
+    results.sort(key=lambda r: (r[args.sort] is None, r[args.sort]))
+    writer = csv.DictWriter(sys.stdout, fieldnames=list(results[0]))
+    writer.writeheader()
+    writer.writerows(results)
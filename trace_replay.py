@@ -0,0 +1,348 @@
+# Record and replay of raw sensor traces
+#
+# TraceRecorder appends every raw sensor sample, relay actuation and
+# Firebase stream event to a compact binary file, timestamped with
+# time.monotonic_ns() deltas (varints), about 20 bytes per 1 s sample:
+#   header   b"BMSTRACE" version:u8 wall_ns:i64 mono_ns:i64
+#   record   delta_ns:varint kind:u8 payload
+#     SENSOR   voltage, current, temperature, humidity as float32 (NaN = failed read)
+#     RELAY    gpio:u8 value:u8 source:u8 (local / remote / initial)
+#     FIREBASE length:varint JSON {"type", "path", "data"}
+#
+# A new recorder never overwrites a trace: the previous file (the one
+# that ends at the crash or power cut) is rotated to path.1, .2, ... first.
+#
+# The replayer feeds a trace back through the same control logic
+# (charger_decision with the voltage-trend forecast, manual override,
+# stream event parsing) and an upload
+# sink, at 1x, accelerated, or flat-out speed, and checks that the relay
+# actions it produces match the recorded ones, so a field bug can be
+# reproduced and a fix proven on the bench:
+#   python trace_replay.py bms.trace                     # as fast as possible
+#   python trace_replay.py bms.trace --speed 100 --firebase-url http://127.0.0.1:9000
+import io  # Buffered trace files
+import os  # Rotation
+import sys  # Exit status for regressions
+import json  # Firebase event payloads
+import math  # NaN for failed reads
+import struct  # Fixed-size fields
+import argparse  # Command line options
+import threading  # Relay / Firebase events arrive on other threads
+from time import monotonic_ns, time_ns, perf_counter, sleep
+
+from charger_policy import charger_decision
+from forecast import TrendForecaster, SETTLE_S
+
+MAGIC = b"BMSTRACE"
+VERSION = 1
+SENSOR, RELAY, FIREBASE = 1, 2, 3
+SOURCES = ("local", "remote", "initial")
+CHANNELS = ("voltage", "current", "temperature", "humidity")
+
+_HEADER = struct.Struct("<Bqq")
+_SENSOR = struct.Struct("<4f")
+_RELAY = struct.Struct("<BBB")
+
+
+def _varint(value):
+    out = bytearray()
+    while value > 0x7F:
+        out.append((value & 0x7F) | 0x80)
+        value >>= 7
+    out.append(value)
+    return out
+
+
+#%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%  Recorder   %%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%
+
+class TraceRecorder:
+    """
+    Appends records to path; thread-safe.
+    - max_bytes: roll over to a new file past this size
+    - backups: rotated files kept (path.1 is the newest)
+    - flush_interval: seconds between flushes to disk
+    - clock: nanosecond monotonic clock (replaceable for synthetic traces)
+    An existing trace at path is rotated, not overwritten.
+    """
+    def __init__(self, path, max_bytes=50 * 1024 * 1024, backups=3, flush_interval=10.0,
+                 clock=monotonic_ns):
+        self.path = path
+        self.clock = clock
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self.flush_ns = int(flush_interval * 1e9)
+        self.lock = threading.Lock()
+        self.file = None
+        if os.path.exists(path) and os.path.getsize(path) > 0:
+            self._rotate()  # Keep the trace of the previous run
+        self._open()
+
+    def _rotate(self):
+        # path.(n-1) -> path.n, ..., path -> path.1; the oldest falls off
+        for n in range(self.backups - 1, 0, -1):
+            if os.path.exists(f"{self.path}.{n}"):
+                os.replace(f"{self.path}.{n}", f"{self.path}.{n + 1}")
+        if self.backups > 0:
+            os.replace(self.path, self.path + ".1")
+
+    def _open(self):
+        self.file = io.open(self.path, "wb")
+        self.last_ns = self.clock()
+        self.flushed_ns = self.last_ns
+        self.size = len(MAGIC) + _HEADER.size
+        self.file.write(MAGIC + _HEADER.pack(VERSION, time_ns(), self.last_ns))
+
+    def _write(self, kind, payload):
+        with self.lock:
+            now = self.clock()
+            record = _varint(now - self.last_ns)
+            record.append(kind)
+            record += payload
+            self.file.write(record)
+            self.last_ns = now
+            self.size += len(record)
+            if now - self.flushed_ns > self.flush_ns:
+                self.file.flush()
+                self.flushed_ns = now
+            if self.max_bytes and self.size > self.max_bytes:
+                self.file.close()
+                self._rotate()
+                self._open()
+
+    def sensor(self, voltage, current, temperature, humidity):
+        values = (voltage, current, temperature, humidity)
+        self._write(SENSOR, _SENSOR.pack(*(math.nan if v is None else v for v in values)))
+
+    def relay(self, gpio, value, source="local"):
+        self._write(RELAY, _RELAY.pack(gpio, 1 if value else 0, SOURCES.index(source)))
+
+    def relay_states(self, states):
+        """
+        Record the relay outputs at start-up, so a replay starts from them.
+        """
+        for gpio, value in states.items():
+            self.relay(gpio, value, "initial")
+
+    def firebase(self, event_type, path, data):
+        body = json.dumps({"type": event_type, "path": path, "data": data},
+                          separators=(",", ":")).encode()
+        self._write(FIREBASE, bytes(_varint(len(body))) + body)
+
+    def close(self):
+        with self.lock:
+            self.file.close()
+
+
+#%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%  Reader   %%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%
+
+def read_trace(path):
+    """
+    Returns (wall_ns at start, list of (t_ns since start, kind, payload dict)).
+    A record cut short by a crash ends the trace quietly.
+    """
+    with open(path, "rb") as f:
+        data = f.read()
+    if data[:len(MAGIC)] != MAGIC:
+        raise ValueError(f"{path} is not a BMS trace")
+    version, wall_ns, _ = _HEADER.unpack_from(data, len(MAGIC))
+    if version != VERSION:
+        raise ValueError(f"{path}: unsupported trace version {version}")
+    pos = len(MAGIC) + _HEADER.size
+    t = 0
+    records = []
+    try:
+        while pos < len(data):
+            delta, pos = _get_varint(data, pos)
+            kind = data[pos]
+            pos += 1
+            if kind == SENSOR:
+                values = _SENSOR.unpack_from(data, pos)
+                pos += _SENSOR.size
+                payload = {name: None if math.isnan(v) else round(v, 4) for name, v in zip(CHANNELS, values)}
+            elif kind == RELAY:
+                gpio, value, source = _RELAY.unpack_from(data, pos)
+                pos += _RELAY.size
+                payload = {"gpio": gpio, "value": value, "source": SOURCES[source]}
+            elif kind == FIREBASE:
+                length, pos = _get_varint(data, pos)
+                if pos + length > len(data):
+                    break
+                payload = json.loads(data[pos:pos + length])
+                pos += length
+            else:
+                raise ValueError(f"{path}: unknown record kind {kind} at byte {pos - 1}")
+            t += delta
+            records.append((t, kind, payload))
+    except (struct.error, IndexError):
+        pass  # Truncated final record
+    return wall_ns, records
+
+
+def _get_varint(data, pos):
+    shift = result = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        result |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            return result, pos
+        shift += 7
+
+
+#%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%  Replay   %%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%
+
+class ReplayController:
+    """
+    The control side of the main program without hardware: stream event
+    parsing (stream_callback), the voltage-trend forecaster (reset when the
+    charger relay changes, settling after a charge), manual override and charger_decision
+    (control_job). Relay values follow the Pi: 1 = relay on, and the
+    charger relay is active-low (relay off = charger on).
+    """
+    def __init__(self, low, high, relay_pins=(5, 6, 13), charger_relay=5, override_relay=6,
+                 lead_time=0.0):
+        self.low = low
+        self.high = high
+        self.relay_pins = relay_pins
+        self.charger_relay = charger_relay
+        self.override_relay = override_relay
+        self.lead_time = lead_time
+        self.relays = {gpio: 0 for gpio in relay_pins}
+        self.forecaster = TrendForecaster(window=1800.0)  # As in the main program
+        self.actions = []  # (sensor sample index, gpio, value) for local actuations
+        self.samples = 0
+
+    def set_relay(self, gpio, value):
+        if gpio not in self.relays:
+            return
+        value = 1 if value else 0
+        if gpio == self.charger_relay and self.relays[gpio] != value:
+            self.forecaster.reset(SETTLE_S if value else 0.0)  # Relay on = charger off: let it settle
+        self.relays[gpio] = value
+
+    def firebase_event(self, event):
+        data, path = event["data"], event["path"]
+        if data is None:
+            return
+        try:
+            if path == "/":
+                states = {int(gpio): int(state) for gpio, state in data.items()}
+            elif path.startswith("/"):
+                states = {int(path[1:]): int(data)}
+            else:
+                return
+        except (ValueError, TypeError, AttributeError):
+            return
+        for gpio, state in states.items():
+            self.set_relay(gpio, state)
+
+    def sensor(self, reading, t):
+        """
+        One sample (t in seconds) and control pass; returns the new charger
+        relay value if it changed.
+        """
+        self.samples += 1
+        self.forecaster.update(t, reading["voltage"])
+        charger_on = not self.relays[self.charger_relay]
+        time_to_low = None if charger_on else self.forecaster.time_to(self.low)
+        if not self.relays[self.override_relay]:
+            return None  # Manual control
+        new_state = charger_decision(reading["voltage"], charger_on, self.low, self.high,
+                                     time_to_low, self.lead_time)
+        if new_state == charger_on:
+            return None
+        value = 0 if new_state else 1
+        self.set_relay(self.charger_relay, value)
+        self.actions.append((self.samples, self.charger_relay, value))
+        return value
+
+
+def replay(wall_ns, records, controller, upload=None, upload_period=18.0, speed=0.0):
+    """
+    Feed records through controller at `speed` x real time (0 = no waiting).
+    upload(reading) is called every upload_period seconds of trace time.
+    Returns a report dict including the recorded vs replayed relay actions.
+    """
+    recorded = []  # (sample index, gpio, value) of recorded local actuations
+    samples = 0
+    uploads = 0
+    next_upload_ns = int(upload_period * 1e9)
+    latest = None
+    max_lag = 0.0
+    start = perf_counter()
+    for t_ns, kind, payload in records:
+        if speed > 0:
+            delay = t_ns / 1e9 / speed - (perf_counter() - start)
+            if delay > 0:
+                sleep(delay)
+            else:
+                max_lag = max(max_lag, -delay)
+        if kind == SENSOR:
+            samples += 1
+            latest = payload
+            controller.sensor(payload, t_ns / 1e9)
+        elif kind == RELAY:
+            if payload["source"] == "initial":
+                controller.set_relay(payload["gpio"], payload["value"])
+            elif payload["source"] == "local":
+                recorded.append((samples, payload["gpio"], payload["value"]))
+        elif kind == FIREBASE:
+            controller.firebase_event(payload)
+        if upload is not None and latest is not None and t_ns >= next_upload_ns:
+            next_upload_ns += int(upload_period * 1e9)
+            reading = {name: value for name, value in latest.items() if value is not None}
+            reading["timestamp"] = (wall_ns + t_ns) // 1000000000
+            upload(reading)
+            uploads += 1
+    elapsed = perf_counter() - start
+    trace_s = records[-1][0] / 1e9 if records else 0.0
+    mismatch = next((i for i, (a, b) in enumerate(zip(recorded, controller.actions)) if a != b),
+                    None if len(recorded) == len(controller.actions) else min(len(recorded), len(controller.actions)))
+    return {"records": len(records), "samples": samples, "uploads": uploads,
+            "trace_s": round(trace_s, 1), "elapsed_s": round(elapsed, 3),
+            "speedup": round(trace_s / elapsed, 1) if elapsed else None,
+            "max_lag_s": round(max_lag, 4),
+            "recorded_actions": len(recorded), "replayed_actions": len(controller.actions),
+            "first_mismatch": None if mismatch is None else {
+                "index": mismatch,
+                "recorded": recorded[mismatch] if mismatch < len(recorded) else None,
+                "replayed": controller.actions[mismatch] if mismatch < len(controller.actions) else None}}
+
+
+if __name__ == "__main__":
+    from bms_config import ConfigManager
+
+    parser = argparse.ArgumentParser(description="Replay a recorded BMS trace")
+    parser.add_argument("trace", help="Trace file written by TraceRecorder")
+    parser.add_argument("--config", default=os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                                         "bms_config.json"))
+    parser.add_argument("--low", type=float, help="Override LOW_THRESHOLD")
+    parser.add_argument("--high", type=float, help="Override HIGH_THRESHOLD")
+    parser.add_argument("--speed", type=float, default=0.0, help="x real time (0 = as fast as possible)")
+    parser.add_argument("--firebase-url", help="Send uploads to this database (e.g. fake_rtdb.py) for load tests")
+    args = parser.parse_args()
+
+    cfg = ConfigManager(args.config).load()
+    controller = ReplayController(args.low or cfg.low_threshold, args.high or cfg.high_threshold,
+                                  cfg.relay_pins, cfg.charger_relay, cfg.override_relay,
+                                  cfg.preemptive_lead_s)
+    bridge = None
+    upload = lambda reading: None  # Count uploads only
+    futures = []
+    if args.firebase_url:
+        from concurrent.futures import wait
+        from firebase_client import FirebaseBridge
+        bridge = FirebaseBridge(args.firebase_url, max_connections=8)
+        upload = lambda reading: futures.append(
+            bridge.set(f"/replay/readings/{reading['timestamp']}", reading))
+
+    wall_ns, records = read_trace(args.trace)
+    report = replay(wall_ns, records, controller, upload, cfg.timer_delay, args.speed)
+    if bridge is not None:
+        start = perf_counter()
+        wait(futures, timeout=60)
+        report["upload_drain_s"] = round(perf_counter() - start, 3)
+        report["upload_failures"] = sum(1 for f in futures if not f.done() or f.exception() is not None)
+        bridge.close(timeout=30)
+    print(json.dumps(report, indent=2))
+    sys.exit(1 if report["first_mismatch"] else 0)